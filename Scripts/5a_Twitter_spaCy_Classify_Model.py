@@ -5,7 +5,7 @@
 ## Description:
 ## This script is for the assigning of taxonomic groups to Twitter #conservation posts using the spaCy classifier.
 ## The script will include sections that detects and filters out non-English texts, as well as sort and categorise posts according to the topic taxonomy. 
-## Other packages used that are within Python Standard Library: re, ast, pathlib
+## Other packages used that are within Python Standard Library: pathlib (re and ast are used within the Scripts//twitter_pipeline modules)
 ## Ensure that the pre-trained english pipeline (i.e. en_core_web_sm) from spacy is installed (python -m spacy download en_core_web_sm)
 ## Youtube tutorial that I referenced: https://www.youtube.com/watch?v=7PD48PFL9VQ&t=1071s
 ## Files from Zenodo (https://doi.org/10.5281/zenodo.11195326): "Twitter_spacy.zip", "spacy-model-best.zip", "Curated_Datasets.zip"
@@ -15,358 +15,135 @@
 from spacy.tokens import DocBin
 import spacy
 import pandas as pd 
-import re
-import ast
+import numpy as np
+import sys
 ## These libraries are for the training part of the code. 
 from pathlib import Path
 from spacy.cli.init_config import fill_config
 from spacy.cli.train import train
 ## Libraries for evaluating
 from spacy.cli.evaluate import evaluate
+## Shared pipeline stages found in the Scripts//twitter_pipeline folder (paths are relative to the project folder, as with the data folders)
+sys.path.insert(0, "Scripts")
+from twitter_pipeline.cleaning import clean_texts, get_stopwords
+from twitter_pipeline.classify import classify_posts, classify_texts, evaluate_classifier
+from twitter_pipeline.backends import SpacyBackend, HashedLogisticBackend
+from twitter_pipeline.docs import build_training_corpora
+from twitter_pipeline.evaluation import evaluate_predictions, average_metrics
+from twitter_pipeline.bootstrap import bootstrap_metrics
+from twitter_pipeline.thresholds import parse_pred_dicts, format_pred_dicts, threshold_sweep, roc_curves, roc_auc_scores
+from twitter_pipeline.store import write_predictions
+from twitter_pipeline.categories import CATEGORIES
+from twitter_pipeline.loading import read_posts
+from twitter_pipeline.cache import PredictionCache, spacy_model_id
+from twitter_pipeline.langfilter import add_languages, is_english
+from twitter_pipeline.instrument import StageMonitor
+## Progress and timing of each step are appended to this log file
+PIPELINE_LOG = "data//pipeline_log.jsonl"
 
 # Step 1. Training the spaCy classifier
 ## Read training dataset (Refer to Supplementary Materials 1 for more information on datasets)
-train_data = pd.read_csv("data//twitter_spaCy_train_data.csv")
-
-## Clean datasets using optimized English pipeline from spaCy: Remove stopwords, non-alphabetical letters, and change all to small caps
-nlp = spacy.load("en_core_web_sm")
-
-cleaned_text_df = pd.DataFrame()
-stopwords = spacy.lang.en.stop_words.STOP_WORDS
-stopwords_to_add = {"save", "saving", "saved",  "conservation", "conserve", "conserving", "conserved", "intl", "conservationorg", "thewcs", "wwf", "natgeowild", "thenatureconservancy", "org", "ipbes", "ifaw", "ifawglobal", "seashepherdglobal", "seashepherd", "unbiodiversity", "verified"}
-stopwords |= stopwords_to_add
-
-for i in range(0, len(train_data)):
-  # Have to use .index because numbers change after removing non-en data
-  text_to_read = train_data['text'][i]
-  if type(text_to_read) == float: 
-    cleaned_text_df = cleaned_text_df._append(pd.DataFrame({"NA"}), ignore_index=True)
-  else: 
-    # Remove all non-alphabetical letters 
-    text_alpha = re.sub('[^a-zA-Z]', ' ', text_to_read)
-    # Change all letters to small caps 
-    text_lower = text_alpha.lower()
-    # Split the caption into tokens
-    text_tokens = text_lower.split()
-    # Remove stopwords 
-    text_stoprm = [word for word in text_tokens if word not in stopwords]
-    # Rejoin non-stopwords words together 
-    text_cleaned = ' '.join(text_stoprm)
-    cleaned_text_df = cleaned_text_df._append(pd.DataFrame({text_cleaned}), ignore_index=True)
-  
-cleaned_text_df.columns = ['cleaned_text'] # Rename column to cleaned_text
+## Only the columns that are used are read, and categories are read as pandas Categorical (see twitter_pipeline//loading.py)
+train_data = read_posts("data//twitter_spaCy_train_data.csv", ['text', 'category'])
+
+## Clean datasets using spaCy's English stopwords: Remove stopwords, non-alphabetical letters, and change all to small caps
+stopwords = get_stopwords() # spaCy's English stopwords with our additions (see STOPWORDS_TO_ADD in twitter_pipeline//cleaning.py)
+
+# Remove all non-alphabetical letters, change all letters to small caps and remove stopwords. Captions that are NaN are stored as "NA".
+# This runs on the whole column at once. For very large datasets, set n_process to split the column into chunks across processes, e.g. clean_texts(train_data['text'], n_process=4)
+# Progress (rows, rows/sec, ETA, peak memory) of the long steps is printed and logged to PIPELINE_LOG, see twitter_pipeline//instrument.py. Set profile="cprofile" or "sample" (or the TWITTER_PIPELINE_PROFILE environment variable) to profile a step.
+with StageMonitor("clean", total=len(train_data), log_path=PIPELINE_LOG) as monitor:
+  cleaned_text_df = pd.DataFrame({'cleaned_text': clean_texts(train_data['text'], stopwords=stopwords, monitor=monitor)})
 
 cleaned_train_data = cleaned_text_df.join(train_data['category']) # Join the cleaned_text_df with the categories from training data
 
 training_data = cleaned_train_data
 
-data_tuples = training_data.to_records(index=False) # Dataset needs to be in tuples so we will convert the pandas dataframe into an array of tuples. 
-
-## Procecss training data to be usable for training textcat
-### Start by defining function make_docs
-def make_docs(data_tuples): 
-  # create an empty list 
-  docs = []
-  # identifying all the categories in the row of data so that the function will know which ones to recognise. 
-  for text, category in nlp.pipe(data_tuples, as_tuples=True): 
-    ## Giving the data a binary code for the categories (this serves as the input for training the spacy model)
-    if category == "Insects":
-      text.cats["Insects"] = 1
-      text.cats["Plants"] = 0
-      text.cats["Other Invertebrate Groups"] = 0
-      text.cats["Birds"] = 0
-      text.cats["Fish"] = 0
-      text.cats["Amphibians & Reptiles"] = 0
-      text.cats["Mammals"] = 0
-      text.cats["Undefined Groups"] = 0
-      text.cats["Others"] = 0
-      ## Then repeat this classification for the other categories. 
-    elif category == "Plants": 
-      text.cats["Insects"] = 0
-      text.cats["Plants"] = 1
-      text.cats["Other Invertebrate Groups"] = 0
-      text.cats["Birds"] = 0
-      text.cats["Fish"] = 0
-      text.cats["Amphibians & Reptiles"] = 0
-      text.cats["Mammals"] = 0
-      text.cats["Undefined Groups"] = 0
-      text.cats["Others"] = 0    
-    elif category == "Other Invertebrate Groups":    
-      text.cats["Insects"] = 0
-      text.cats["Plants"] = 0
-      text.cats["Other Invertebrate Groups"] = 1
-      text.cats["Birds"] = 0
-      text.cats["Fish"] = 0
-      text.cats["Amphibians & Reptiles"] = 0
-      text.cats["Mammals"] = 0
-      text.cats["Undefined Groups"] = 0
-      text.cats["Others"] = 0  
-    elif category == "Birds":     
-      text.cats["Insects"] = 0
-      text.cats["Plants"] = 0
-      text.cats["Other Invertebrate Groups"] = 0
-      text.cats["Birds"] = 1
-      text.cats["Fish"] = 0
-      text.cats["Amphibians & Reptiles"] = 0
-      text.cats["Mammals"] = 0
-      text.cats["Undefined Groups"] = 0
-      text.cats["Others"] = 0  
-    elif category == "Fish":      
-      text.cats["Insects"] = 0
-      text.cats["Plants"] = 0
-      text.cats["Other Invertebrate Groups"] = 0
-      text.cats["Birds"] = 0
-      text.cats["Fish"] = 1
-      text.cats["Amphibians & Reptiles"] = 0
-      text.cats["Mammals"] = 0
-      text.cats["Undefined Groups"] = 0
-      text.cats["Others"] = 0  
-    elif category == "Amphibians & Reptiles":      
-      text.cats["Insects"] = 0
-      text.cats["Plants"] = 0
-      text.cats["Other Invertebrate Groups"] = 0
-      text.cats["Birds"] = 0
-      text.cats["Fish"] = 0
-      text.cats["Amphibians & Reptiles"] = 1
-      text.cats["Mammals"] = 0
-      text.cats["Undefined Groups"] = 0
-      text.cats["Others"] = 0  
-    elif category == "Mammals":       
-      text.cats["Insects"] = 0
-      text.cats["Plants"] = 0
-      text.cats["Other Invertebrate Groups"] = 0
-      text.cats["Birds"] = 0
-      text.cats["Fish"] = 0
-      text.cats["Amphibians & Reptiles"] = 0
-      text.cats["Mammals"] = 1
-      text.cats["Undefined Groups"] = 0
-      text.cats["Others"] = 0  
-    elif category == "Undefined Groups":        
-      text.cats["Insects"] = 0
-      text.cats["Plants"] = 0
-      text.cats["Other Invertebrate Groups"] = 0
-      text.cats["Birds"] = 0
-      text.cats["Fish"] = 0
-      text.cats["Amphibians & Reptiles"] = 0
-      text.cats["Mammals"] = 0
-      text.cats["Undefined Groups"] = 1
-      text.cats["Others"] = 0  
-    elif category == "Others":        
-      text.cats["Insects"] = 0
-      text.cats["Plants"] = 0
-      text.cats["Other Invertebrate Groups"] = 0
-      text.cats["Birds"] = 0
-      text.cats["Fish"] = 0
-      text.cats["Amphibians & Reptiles"] = 0
-      text.cats["Mammals"] = 0
-      text.cats["Undefined Groups"] = 0
-      text.cats["Others"] = 1
-    docs._append(text)
-  return(docs)
-
-## Step 2. Create the training texts for the spacy train module. Here, we used the same dataset (i.e. data_tuples) to create our train and valid spaCy files.
-# Example code:
-# train_docs = make_docs(data_tuples)
-# doc_bin = DocBin(docs=train_docs)
-# doc_bin.to_disk("INSERT PATH")
-# Refer to "train.spacy" and "valid.spacy".
+## Process training data to be usable for training textcat
+## Each text is tokenized (the tagger, parser and NER of en_core_web_sm are not needed for textcat) and given a binary code for the categories (doc.cats), see twitter_pipeline//docs.py
+
+## Step 2. Create the training texts for the spacy train module. 
+## The published model used the same dataset (i.e. training_data) to create our train and valid spaCy files (refer to "train.spacy" and "valid.spacy"); this is done with valid_fraction=0.
+## Here, 20% of the posts of each category are set aside as the valid set instead (the split is the same every time for the same seed). Docs are saved in shards of 10000 docs within the "train" and "valid" folders.
+train_path, valid_path = build_training_corpora(training_data['cleaned_text'], training_data['category'], "data//spacy_corpus", valid_fraction=0.2, seed=1234, shard_size=10000)
 
 ## Step 3. Train the spaCy model using a modified config file "config_modified.cfg". Set the correct paths for the model output and datasets (train.spacy; valid.spacy), see https://spacy.io/usage/training#quickstart.
 ## This step will take awhile. Alternatively, you may download "model-best.zip" (i.e. the best performing classifier) for subsequent steps.
-train(config_path=Path("data//config_modified.cfg"), output_path=Path("data//spacy_model"), overrides={"paths.train": "data//train.spacy", "paths.dev": "data//valid.spacy"}) 
+train(config_path=Path("data//config_modified.cfg"), output_path=Path("data//spacy_model"), overrides={"paths.train": str(train_path), "paths.dev": str(valid_path)}) 
+
+## Optional: before training the final model, settings can be compared by k-fold cross-validation (see twitter_pipeline//tuning.py). Every combination of the values in the grid is trained on 4 of 5 folds and evaluated on the 5th, in parallel across the cores.
+## Architectures are compared by listing one config file per architecture under "config". Results are saved to "data//spacy_tuning//leaderboard.csv" (mean and standard deviation across folds of each setting).
+# from twitter_pipeline.tuning import run_search
+# leaderboard, fold_results = run_search(training_data['cleaned_text'], training_data['category'], "data//config_modified.cfg", {"training.dropout": [0.1, 0.2], "training.optimizer.learn_rate": [0.001, 0.0001]}, "data//spacy_tuning", k=5, threads_per_job=1)
 
 ## Step 4. Evaluating the best performing classifier
 # Read test dataset & trained spaCy model
-cleaned_test_data = pd.read_csv("data//twitter_spaCy_test_data.csv")
+cleaned_test_data = read_posts("data//twitter_spaCy_test_data.csv", ['cleaned_text', 'category'])
 
 # Download and unzip "spacy-model-best.zip" for the best performing classifier
 # In the config.cfg file in the "model-best" folder, ensure that the paths to the "train" and "dev" are set to where you have stored the "train.spacy" and "valid.spacy" files.
 my_nlp = spacy.load("data//spacy_model-best//model-best")
 
-pred_df = pd.DataFrame(columns=['pred_dict', 'pred_cat'], index=range(0,len(cleaned_test_data)))
-
 # Assign categories to each post in the test dataset
-for t in range(0, len(cleaned_test_data)):
-  text_to_classify = cleaned_test_data['cleaned_text'][t]
-  # If else to classify NaN data as Others 
-  if type(text_to_classify) == float:
-    pred_df['pred_dict'][t] = ['NA']
-    pred_df['pred_cat'][t] = "Others"
-  else:
-    # Run cleaned_text through new model 
-    doc = my_nlp(text_to_classify)
-    # obtain all values for each of the categories (probability that the model thinks this text belongs to the category)
-    pred_df['pred_dict'][t] = doc.cats
-    # Predicting category based on highest probability
-    predictions = doc.cats.values()
-    max_value = max(predictions)
-    predicted_key = {i for i in doc.cats if doc.cats[i]==max_value}
-    predicted_cat = ''.join(predicted_key)
-    # Store this predicted category as pred_cat in df
-    pred_df['pred_cat'][t] = predicted_cat
+# The captions are run through the textcat component in batches and its probabilities are written into an array (one column per category in CATEGORIES order; NaN captions get NaN and are assigned as "Others"), see twitter_pipeline//classify.py
+# Each post is assigned the category with the highest probability. When categories tie for the highest probability, the one that comes first in CATEGORIES is assigned.
+with StageMonitor("classify_test", total=len(cleaned_test_data), log_path=PIPELINE_LOG) as monitor:
+  test_probs, test_pred_cat = classify_texts(my_nlp, cleaned_test_data['cleaned_text'], batch_size=1000, monitor=monitor)
+
+# The probabilities are kept as a dict string per post (pred_dict), as in "test_spaCy_twitter_eval.csv"
+pred_df = pd.DataFrame({'pred_dict': format_pred_dicts(test_probs), 'pred_cat': test_pred_cat})
 
 # Join both df together 
 spaCy_eval = cleaned_test_data.join(pred_df)
 # Refer to "test_spaCy_twitter_eval.csv" for test dataset with assigned categories
+# The probabilities and categories can also be saved as a prediction store (float32 probabilities and int8 category codes in .npy files) instead of the pred_dict strings:
+# from twitter_pipeline.store import convert_eval_csv
+# convert_eval_csv("data//test_spaCy_twitter_eval.csv", "data//test_spaCy_twitter_eval_store")
 
 # If you had not run the above code, please run the below line to call the spaCy_eval data (i.e. test dataset with assigned categories). 
-spaCy_eval = pd.read_csv("data//test_spaCy_twitter_eval.csv")
+spaCy_eval = read_posts("data//test_spaCy_twitter_eval.csv", ['category', 'pred_cat'])
 
 ## Determine the evaluation metrics for this model
 ## Since it is a multiclass classification, I need to get the TP, FP, TN and FN for each class and calculate the precision, accuracy, recall and specificity
-cats = list(doc.cats.keys())
-eval_metrics = pd.DataFrame(columns=['category', 'TP', 'FP', 'TN', 'FN', 'accuracy', 'precision', 'recall', 'specificity'], index=range(0,len(cats)))
-
-for c in range(0, len(cats)): 
-  category = cats[c]
-  eval_metrics['category'][c] = category
-  # TP = spaCy recognise as category and I recognise as category 
-  TP = len(spaCy_eval.index[(spaCy_eval['pred_cat']==category) & (spaCy_eval['category']==category)])
-  eval_metrics['TP'][c] = TP
-  # FP = spaCy recognise as category and I recognise as not category 
-  FP = len(spaCy_eval.index[(spaCy_eval['pred_cat']==category) & (spaCy_eval['category']!=category)])
-  eval_metrics['FP'][c] = FP
-  # TN = spaCy recognise as not category and I recognise as not category 
-  TN = len(spaCy_eval.index[(spaCy_eval['pred_cat']!=category) & (spaCy_eval['category']!=category)])
-  eval_metrics['TN'][c] = TN
-  # FN = spaCy recognise as not category and I recognise as category 
-  FN = len(spaCy_eval.index[(spaCy_eval['pred_cat']!=category) & (spaCy_eval['category']==category)])
-  eval_metrics['FN'][c] = FN
-  
-  sum = TP+TN+FP+FN
-  # Check 
-  if sum != len(spaCy_eval): 
-    print("ERROR, NOT EQUIVALENT")
-    break 
-  
-  # Calculate accuracy [% of correct predictions]
-  try: 
-    accuracy = (TP+TN)/(TP+TN+FP+FN)
-  except ZeroDivisionError: 
-    accuracy = 0
-  eval_metrics['accuracy'][c] = accuracy
-  # Calculate precision [% of positive predictions correct]
-  try: 
-    precision = TP/(TP+FP)
-  except ZeroDivisionError: 
-    precision = 0
-  eval_metrics['precision'][c] = precision
-  # Calculate recall [% of correct positive predictions]
-  try: 
-    recall = TP/(TP+FN)
-  except ZeroDivisionError: 
-    recall = 0
-  eval_metrics['recall'][c] = recall
-  # Calculate specificity [% of correct negative predictions]
-  try: 
-    specificity=TN/(TN+FP)
-  except ZeroDivisionError: 
-    specificity = 0
-  eval_metrics['specificity'][c] = specificity  
+## The confusion matrix of all 9 categories is counted in one pass, then the metrics of each category are calculated from it (see twitter_pipeline//evaluation.py)
+eval_metrics = evaluate_predictions(spaCy_eval['category'], spaCy_eval['pred_cat'])
+## Macro and micro averages across the categories
+eval_metrics_average = average_metrics(eval_metrics)
 ## Refer to "test_spaCy_twitter_eval_metrics.csv" for evaulation results.
+## 95% confidence intervals of the metrics of each category (and of the macro and micro averages) from 10,000 bootstrap resamples of the test posts (see twitter_pipeline//bootstrap.py)
+eval_metrics_ci = bootstrap_metrics(spaCy_eval['category'], spaCy_eval['pred_cat'], n_resamples=10000, ci=0.95, seed=1234)
+
+## Faster alternative classifier: a logistic regression over hashed single words and word pairs of the cleaned captions (see twitter_pipeline//backends.py), trained on the same training data.
+## Both classifiers give the same 9 category probabilities, so they are evaluated in the same way and compared on accuracy and posts classified per second.
+## The probabilities (hashed_probs) can be passed to threshold_sweep and roc_curves in Step 5 in place of probs.
+hashed_model = HashedLogisticBackend().fit(training_data['cleaned_text'], training_data['category'], n_epochs=10, seed=1234)
+hashed_model.save("data//hashed_model")
+hashed_probs, hashed_eval_metrics, hashed_summary = evaluate_classifier(hashed_model, cleaned_test_data['cleaned_text'], cleaned_test_data['category'])
+spacy_probs, spacy_eval_metrics, spacy_summary = evaluate_classifier(SpacyBackend(my_nlp, spacy_model_id("data//spacy_model-best//model-best")), cleaned_test_data['cleaned_text'], cleaned_test_data['category'])
+backend_comparison = pd.concat([spacy_summary, hashed_summary], ignore_index=True)
   
 ## Step 5. Run spaCy classifiers using different Area Under the Curve (AUC) thresholds to determine appropriate thresholds for to classify the category based on the probabilities produced by the model.
 ## For context, the model produces a probability of which each taxonomic category is applicable. Sample of model output: '{'Insects': 0.003, 'Plants': 0.002, 'Other Invertebrate Groups': 0.013, 'Birds': 0.004, 'Fish': 0.013, 'Amphibians & Reptiles': 0.008, 'Mammals': 0.025, 'Undefined Groups': 0.148, 'Others': 0.781}
-## In the above Lines 188-205, the determination for most appropriate category was deemed by adopting the maximum probability among the categories. 
+## In Step 4 above, the determination for most appropriate category was deemed by adopting the maximum probability among the categories. 
 ## In the below, we will evaluate different thresholds to compare against the "maximum" method that we had adopted above. 
 ## As there could be a case where more than 1 category is above the threshold, we assign that text as "Undefined Groups"
 ## Vice versa, where there are cases that none of the categories cross the threshold, we assign that text as "Others"
 
 ## Read evaluation data. 
-ran_data = pd.read_csv("data//test_spaCy_twitter_eval.csv")
+ran_data = read_posts("data//test_spaCy_twitter_eval.csv", ['pred_dict', 'category'])
 
-all_eval_metrics = pd.DataFrame()
-summary_eval_metrics = pd.DataFrame()
+## Decode the pred_dict column once into an array of probabilities (one column per category)
+with StageMonitor("parse_pred_dicts", total=len(ran_data), log_path=PIPELINE_LOG) as monitor:
+  probs = parse_pred_dicts(ran_data['pred_dict'])
+  monitor.update(len(ran_data))
+## Alternatively, read the probabilities memory-mapped from the prediction store (see Step 4) instead of decoding pred_dict:
+# from twitter_pipeline.store import read_probs
+# probs = read_probs("data//test_spaCy_twitter_eval_store")
 
-for t in range(10, 100, 5):
-  threshold = t/100
-  alt_pred = pd.DataFrame(columns=['alt_cat'], index=range(0,len(ran_data)))
-  
-  for p in range(0, len(ran_data)):
-    predictions = ran_data['pred_dict'][p]
-    predictions = ast.literal_eval(predictions)
-    # Get dict of categories and values that are above the threshold
-    try: 
-      alt_cats = {key:val for key, val in predictions.items() if val > threshold}
-    except AttributeError: 
-      alt_cats = ["Others"]
-    # If more than 1 category above threshold, assign Undefined Groups
-    if len(alt_cats) > 1: 
-      alt_cat = "Undefined Groups"
-    # If less than 1 category above threshold, assign Others
-    elif len(alt_cats) < 1: 
-      alt_cat = "Others"
-    else: 
-      try: 
-        alt_cat = {key for key, val in alt_cats.items()}
-      except AttributeError:
-        alt_cat = alt_cats
-      # Make into string
-      alt_cat = ''.join(alt_cat)
-    alt_pred['alt_cat'][p] = alt_cat
-  
-  new_data = ran_data.join(alt_pred)
-  eval_metrics = pd.DataFrame(columns=['threshold', 'category', 'TP', 'FP', 'TN', 'FN', 'accuracy', 'precision', 'recall', 'specificity', 'fpr'], index=range(0,len(predictions)))
-  
-  for c in range(0, len(predictions)):
-    eval_metrics['threshold'][c] = threshold
-    categories = list(predictions.keys())
-    category = categories[c]
-    eval_metrics['category'][c] = category
-    # TP = threshold recognise as category and I recognise as category 
-    TP = len(new_data.index[(new_data['alt_cat']==category) & (new_data['category']==category)])
-    eval_metrics['TP'][c] = TP
-    # FP = spaCy recognise as category and I recognise as not category 
-    FP = len(new_data.index[(new_data['alt_cat']==category) & (new_data['category']!=category)])
-    eval_metrics['FP'][c] = FP
-    # TN = spaCy recognise as not category and I recognise as not category 
-    TN = len(new_data.index[(new_data['alt_cat']!=category) & (new_data['category']!=category)])
-    eval_metrics['TN'][c] = TN
-    # FN = spaCy recognise as not category and I recognise as category 
-    FN = len(new_data.index[(new_data['alt_cat']!=category) & (new_data['category']==category)])
-    eval_metrics['FN'][c] = FN
-    
-    sum = TP+TN+FP+FN
-    # Check 
-    if sum != len(new_data): 
-      print("ERROR, NOT EQUIVALENT")
-      break 
-    
-    # Calculate accuracy [% of correct predictions]
-    try: 
-      accuracy = (TP+TN)/(TP+TN+FP+FN)
-    except ZeroDivisionError:  
-      accuracy = 0
-    eval_metrics['accuracy'][c] = accuracy
-    # Calculate precision [% of positive predictions correct]
-    try: 
-      precision = TP/(TP+FP)
-    except ZeroDivisionError: 
-      precision = 0
-    eval_metrics['precision'][c] = precision
-    # Calculate recall [% of correct positive predictions]
-    try: 
-      recall = TP/(TP+FN)
-    except ZeroDivisionError:  
-      recall = 0
-    eval_metrics['recall'][c] = recall
-    # Calculate specificity [% of correct negative predictions]
-    try: 
-      specificity=TN/(TN+FP)
-    except ZeroDivisionError:  
-      specificity = 0
-    eval_metrics['specificity'][c] = specificity
-    try: 
-      fpr = FP/(FP+TN)
-    except ZeroDivisionError:
-      fpr = 0
-    eval_metrics['fpr'][c] = fpr
-    
-  ## Add these eval metrics to the all_eval_metrics
-  all_eval_metrics = all_eval_metrics._append(eval_metrics, ignore_index = True)
-  ## Get average of eval_metrics of all categories
-  eval_mean = eval_metrics.mean() 
-  summary_eval_metrics = summary_eval_metrics._append(eval_mean, ignore_index=True)
+## Evaluate all thresholds (10% to 95%, in steps of 5%) at once. Finer grids of thresholds can be used, e.g. np.arange(1, 100) / 100
+with StageMonitor("threshold_sweep", total=len(ran_data), log_path=PIPELINE_LOG) as monitor:
+  all_eval_metrics, summary_eval_metrics = threshold_sweep(probs, ran_data['category'], thresholds=np.arange(10, 100, 5) / 100)
+  monitor.update(len(ran_data))
 
 ## Refer to "threshold_spaCy_all_eval_metrics_twitter.csv" for the evaluation metrics for each category.
 ## Refer to "threshold_spaCy_summary_eval_metrics_twitter.csv" for the evaluation for each threshold (averaged across categories).
@@ -374,34 +151,57 @@ for t in range(10, 100, 5):
 summary_eval_metrics = pd.read_csv("data//threshold_spaCy_summary_eval_metrics_twitter.csv")
 
 ## From here, you may plot the ROC curve to identify the most appropriate threshold. 
+## ROC curve of each category at 1000 thresholds and the area under each curve
+roc = roc_curves(probs, ran_data['category'], thresholds=np.linspace(0, 1, 1001))
+roc_auc = roc_auc_scores(roc)
 ## As we have the various eval_metrics, we may also simply compare the metrics accordingly across the thresholds and against the "maximum" method.
 
 ## Step 6. Applying the trained spaCy classifer all download #conservation posts for categorization
 # Read data
-conservation_posts = pd.read_csv("Curated_Datasets//5_1_Twiiter.csv")
+# Only the raw captions (for language detection) and cleaned captions (for classification) are read; add any other columns that are needed to the list
+# Set POST_ID_COL to the post ID column of the export, if it has one; it is only read when the column is in the file
+POST_ID_COL = None
+id_columns = [POST_ID_COL] if POST_ID_COL in pd.read_csv("Curated_Datasets//5_1_Twiiter.csv", nrows=0).columns else []
+conservation_posts = read_posts("Curated_Datasets//5_1_Twiiter.csv", id_columns + ['Raw_Caption', 'Cleaned_Caption'])
+# Keep the row number of each post within the file before non-English posts are filtered out (reset_index renumbers the rows), so that the results can be joined back to the posts.
+# The post ID column is used as the ID of each post when it was read, otherwise the row number.
+conservation_posts["Row_ID"] = conservation_posts.index
+ID_COL = id_columns[0] if id_columns else "Row_ID"
+# For files larger than memory, the posts can be read and classified in chunks instead, e.g.:
+# from twitter_pipeline.loading import iter_posts
+# for chunk in iter_posts("Curated_Datasets//5_1_Twiiter.csv", id_columns + ['Raw_Caption', 'Cleaned_Caption'], chunk_size=100000):
+#   chunk["Category"] = classify_texts(my_nlp, chunk["Cleaned_Caption"], n_process=4)[1]
+#   chunk.to_csv("data//5_1_Twiiter_classified.csv", mode="a", header=chunk.index[0] == 0, index=False)
 list(conservation_posts) # view column headers
 
+# Filter out non-English posts before classifying. The language and language_score (confidence) of each post are detected from the raw captions in batches across n_process processes, see twitter_pipeline//langfilter.py
+conservation_posts = add_languages(conservation_posts, "Raw_Caption", n_process=4)
+conservation_posts = conservation_posts[is_english(conservation_posts)].reset_index(drop=True)
+
 # Load the trained classifier
 my_nlp = spacy.load("data//spacy_model//model-best")
 
 conservation_posts["Category"] = "NA" 
 
+# The Cleaned_Caption column is already provided in "5_1_Twiiter.csv". For new posts, clean the raw captions in the same way as the training data in Step 1:
+# conservation_posts["Cleaned_Caption"] = clean_texts(conservation_posts["Raw_Caption"], n_process=4).values
+
 # Assign categories to each #conservation post
-# This will take awhile due to the large number of posts. You may run these codes on another dataset.
-for t in range(0,len(test_data)): 
-  text_to_classify = conservation_posts["Cleaned_Caption"][t]
-  if type(text_to_classify) == float:
-    conservation_posts["Category"][t] = "Others"
-  else: 
-    # Running text through the new model I created 
-    doc = my_nlp(text_to_classify)
-    # Obtaining all values for each of the categories 
-    predictions = doc.cats.values()
-    # Finding out which category has the highest probability
-    max_value = max(predictions)
-    # Denoting the category with the highest probability as the predicted category for the text. The highest probability method was evaluated and determined to be the best after testing other thresholds through the AUC-ROC methods. For the code and results of the evaluation conducted, please refer to the codes below or the data found within the spaCy_model_evaluation_data folder. 
-    predicted_key = {i for i in doc.cats if doc.cats[i]==max_value}
-    # Using join to change it to a nice string like the other datasets
-    predicted_cat = ''.join(predicted_key)
-    # Storing the data on file
-    conservation_posts["Category"][t] = predicted_cat
+# Captions are run through the textcat component in batches; increase n_process to use more cores. Each post is assigned the category with the highest probability (ties go to the category that comes first in CATEGORIES), and captions that are NaN are assigned as "Others".
+# The highest probability method was evaluated and determined to be the best after testing other thresholds through the AUC-ROC methods. For the code and results of the evaluation conducted, please refer to the codes above or the data found within the spaCy_model_evaluation_data folder.
+# Results are saved in chunks to "data//spacy_classified_posts". If the run is interrupted, re-running this line continues from the last completed chunk (chunks of another model or other captions are removed and classified again).
+# Probabilities are also kept in a cache (data//spacy_cache.sqlite) for this model, so captions that are repeated (e.g. retweets) or were classified in an earlier run are not run through the model again
+my_model_id = spacy_model_id("data//spacy_model//model-best")
+with PredictionCache("data//spacy_cache.sqlite", my_model_id) as cache, StageMonitor("classify", total=len(conservation_posts), log_path=PIPELINE_LOG) as monitor:
+  classified_posts = classify_posts(SpacyBackend(my_nlp, my_model_id), conservation_posts["Cleaned_Caption"], out_dir="data//spacy_classified_posts", chunk_size=100000, batch_size=1000, n_process=4, cache=cache, monitor=monitor)
+  print(cache.report())
+conservation_posts["Category"] = classified_posts["Category"].values
+# For new pulls of posts, only the posts that are new or whose caption changed since the last run (or that were classified by an older model) need to be classified. Posts are matched by ID_COL (row numbers only match the same posts as long as new posts are added at the end of the file, so set POST_ID_COL where the export has post IDs):
+# from twitter_pipeline.incremental import IncrementalStore, classify_incremental
+# with IncrementalStore("data//incremental_store.sqlite") as store:
+#   classified_posts = classify_incremental(store, my_nlp, my_model_id, conservation_posts, id_col=ID_COL, text_col="Cleaned_Caption", n_process=4)
+
+# To classify incoming posts (e.g. for dashboards) without loading the model for each request, the trained classifier can be served locally with twitter_pipeline//service.py, which returns the probabilities and the highest-probability category as above
+
+# Save the probabilities and categories as a prediction store next to the post IDs (ID_COL). Use read_predictions(path, columns=..., rows=...) to load only what is needed.
+write_predictions("data//spacy_predictions", classified_posts[CATEGORIES].to_numpy(), conservation_posts[ID_COL], pred_cat=classified_posts["Category"])
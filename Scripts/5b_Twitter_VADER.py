@@ -3,7 +3,7 @@
 ####### (5b) Twitter - VADER Sentiment Analysis
 
 ## Description:
-## This script is for determining the sentiments of captions in insect #conservation posts from Twitter using the VADER sentiment analysis.
+## This script is for determining the sentiments of captions in insect #conservation posts (and all #conservation posts) from Twitter using the VADER sentiment analysis.
 ## VADER is pre-trained and created with the intention of using it for social media data. The VADER model produces a likelihood of sentiments (positive, negative or neutral).
 ## The model produces a compound score and the sentiments are assigned based on the following thresholds: positive >= 0.05, -0.05 > neutral > 0.05, negative <= -0.05. 
 ## Note that the VADER model was performed on raw captions as punctuations and word shape (e.g. caps) are used to determine sentiments. 
@@ -12,61 +12,56 @@
 
 # {python}
 ## Importing relevant libraries
-import pandas as pd
 import re
+import sys
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-import spacy 
-from spacy.language import Language
-from spacy_langdetect import LanguageDetector
-# Create a factory for language detector first. Source code: https://github.com/Abhijit-2592/spacy-langdetect/issues/6
-@Language.factory("language_detector")
-def create_language_detector(nlp, name):
-  return LanguageDetector(language_detection_function=None)
+## Shared pipeline stages found in the Scripts//twitter_pipeline folder (paths are relative to the project folder)
+sys.path.insert(0, "Scripts")
+from twitter_pipeline.sentiment import sentiment_frame
+from twitter_pipeline.cache import PredictionCache, vader_model_id
+from twitter_pipeline.langfilter import add_languages, is_english
+from twitter_pipeline.instrument import StageMonitor
+from twitter_pipeline.loading import read_posts
+## Progress and timing of each step are appended to this log file
+PIPELINE_LOG = "data//pipeline_log.jsonl"
 # Detect the language of the captions to sort out English texts. Code was adapted from: https://towardsdatascience.com/4-python-libraries-to-detect-english-and-non-english-language-c82ad3efd430 
-## Start off by adding the LanguageDetector as a pipe to the processing pipeline
-nlp = spacy.load("en_core_web_sm")
-nlp.add_pipe("language_detector")
+## The language detector (langdetect, as used by spacy_langdetect) runs as a component of a tokenizer-only spaCy pipeline, in batches across n_process processes, see twitter_pipeline//langfilter.py
 
 ## Create Vader Sentiment analyser
 analyser = SentimentIntensityAnalyzer()
 
-## Read data
-insect_conservation_posts = pd.read_csv("Curated_Datasets//5_2_Twiiter_Insects.csv")
+## Read data. Only the raw captions are needed here; add any other columns that are needed to the list (see twitter_pipeline//loading.py)
+insect_conservation_posts = read_posts("Curated_Datasets//5_2_Twiiter_Insects.csv", ['Raw_Caption'])
 list(insect_conservation_posts) # View column headers
 
-all_caption_sentiment_new = []
-caption_compound_score_new = []
-caption_pos_score_new = []
-caption_neu_score_new = []
-caption_neg_score_new = []
+## Add the language and language_score columns, and only keep English posts for the sentiment analysis
+insect_conservation_posts = add_languages(insect_conservation_posts, 'Raw_Caption', n_process=4)
+insect_conservation_posts = insect_conservation_posts[is_english(insect_conservation_posts)].reset_index(drop=True)
 
 ## Run VADER Sentiment analyzer on raw captions across all insect #conservation posts
-for i in range(0, len(insect_conservation_posts)): 
-  ## For every row, I need to pull the caption out from the dictionary
-  caption = insect_conservation_posts['Raw_Caption'][i]
-    
-  ## Determine sentiment of caption
-  caption_score = analyser.polarity_scores(caption)
-  caption_compound = caption_score['compound']
-  caption_pos = caption_score['pos']
-  caption_neu = caption_score['neu']
-  caption_neg = caption_score['neg']
-  if caption_compound >= 0.05:
-    caption_sentiment = 'pos'
-  elif caption_compound <= -0.05:
-    caption_sentiment = 'neg'
-  else:
-    caption_sentiment = 'neu'
-  
-  all_caption_sentiment_new.append(caption_sentiment)
-  caption_compound_score_new.append(caption_compound)
-  caption_pos_score_new.append(caption_pos)
-  caption_neu_score_new.append(caption_neu)
-  caption_neg_score_new.append(caption_neg)
-  
-# Save calculated VADER scores  
-insect_conservation_posts['caption_sentiment_new'] = all_caption_sentiment_new
-insect_conservation_posts['caption_compound_score'] = caption_compound_score_new
-insect_conservation_posts['caption_pos_score'] = caption_pos_score_new
-insect_conservation_posts['caption_neu_score'] = caption_neu_score_new
-insect_conservation_posts['caption_neg_score'] = caption_neg_score_new
+## Captions are scored in chunks across n_process worker processes (each with its own SentimentIntensityAnalyzer), and sentiments are assigned from the compound scores in one step
+## Scores are kept in a cache (data//vader_cache.sqlite), so captions that are repeated (e.g. retweets) or were scored in an earlier run are not scored again
+## Progress (rows, rows/sec, ETA, peak memory) is printed and logged to PIPELINE_LOG, see twitter_pipeline//instrument.py
+with PredictionCache("data//vader_cache.sqlite", vader_model_id(), normalize=True) as cache, StageMonitor("vader_insects", total=len(insect_conservation_posts), log_path=PIPELINE_LOG) as monitor:
+  caption_sentiments = sentiment_frame(insect_conservation_posts['Raw_Caption'], analyser=analyser, cache=cache, n_process=4, monitor=monitor)
+  print(cache.report())
+
+# Save calculated VADER scores (columns caption_sentiment_new, caption_compound_score, caption_pos_score, caption_neu_score, caption_neg_score)
+for column in caption_sentiments:
+  insect_conservation_posts[column] = caption_sentiments[column].values
+
+## For new pulls of posts, only the posts that are new or whose caption changed since the last run need to be scored. Posts are matched by an ID column: read the post ID column of the export (if it has one) with the captions and set id_col to it,
+## or keep the row number of each post within the file before the English filter (insect_conservation_posts["Row_ID"] = insect_conservation_posts.index) and use id_col="Row_ID" (row numbers only match the same posts as long as new posts are added at the end of the file)
+# from twitter_pipeline.incremental import IncrementalStore, sentiment_incremental
+# with IncrementalStore("data//incremental_store.sqlite") as store:
+#   caption_sentiments = sentiment_incremental(store, insect_conservation_posts, id_col="Row_ID", text_col="Raw_Caption", n_process=4)
+
+## The same can be run across all #conservation posts (i.e. all taxonomic groups)
+conservation_posts = read_posts("Curated_Datasets//5_1_Twiiter.csv", ['Raw_Caption'])
+conservation_posts = add_languages(conservation_posts, 'Raw_Caption', n_process=4)
+conservation_posts = conservation_posts[is_english(conservation_posts)].reset_index(drop=True)
+with PredictionCache("data//vader_cache.sqlite", vader_model_id(), normalize=True) as cache, StageMonitor("vader_all", total=len(conservation_posts), log_path=PIPELINE_LOG) as monitor:
+  conservation_sentiments = sentiment_frame(conservation_posts['Raw_Caption'], cache=cache, n_process=4, monitor=monitor)
+  print(cache.report())
+for column in conservation_sentiments:
+  conservation_posts[column] = conservation_sentiments[column].values
@@ -0,0 +1,14 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### (5e) Twitter - command line for the pipeline stages
+
+## Description:
+## Runs a single stage of the Twitter pipeline (5a, 5b) from the command line, e.g. only classifying posts with the trained model, without training it again.
+## Stages are skipped when their inputs, model and settings have not changed since the last run. See Scripts//twitter_pipeline//cli.py for details.
+## Run from the project folder: python Scripts//5e_Twitter_pipeline_cli.py --help
+
+import sys
+
+from twitter_pipeline.cli import main
+
+if __name__ == '__main__':
+  sys.exit(main())
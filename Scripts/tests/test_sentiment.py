@@ -0,0 +1,26 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - tests of the VADER sentiment scores
+
+## Description:
+## Run from the project folder with: python -m pytest Scripts//tests
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from twitter_pipeline.sentiment import SCORE_COLUMNS, score_captions, sentiment_frame
+
+def test_empty_input():
+  ## e.g. when the English filter of 5b leaves no posts
+  assert score_captions([]).shape == (0, len(SCORE_COLUMNS))
+  assert score_captions(pd.Series([], dtype=object)).shape == (0, len(SCORE_COLUMNS))
+  assert len(sentiment_frame([])) == 0
+
+def test_all_nan_input():
+  scores = score_captions(pd.Series([np.nan, np.nan, None]))
+  assert scores.shape == (3, len(SCORE_COLUMNS))
+  assert np.isnan(scores).all()
+  assert sentiment_frame([np.nan, np.nan])['caption_sentiment_new'].isna().all()
@@ -0,0 +1,6 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline helpers
+
+## Description:
+## Reusable stages shared by the Twitter scripts (5a, 5b). The scripts add the "Scripts" folder to the path and import from here, e.g.
+## from twitter_pipeline.cleaning import clean_texts
@@ -0,0 +1,237 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - classifier backends
+
+## Description:
+## Classifiers that can be used in place of the trained spaCy textcat model in classify.py, the service and the command line.
+## Each backend turns a list of captions into batches of probabilities (columns in CATEGORIES order), so all backends give the same 9-category probabilities and can be evaluated in the same way (Step 4 and Step 5 of 5a).
+## SpacyBackend: the trained spaCy textcat model (model-best), running only the textcat component (and the components it listens to) in batches.
+## HashedLogisticBackend: a multinomial logistic regression over hashed unigram and bigram counts of the cleaned captions, in NumPy only.
+##   Much faster than spaCy inference for reprocessing millions of posts, at some cost in accuracy (compare the two with evaluate_classifier in classify.py).
+##   The features are kept as sparse rows (CSR: indptr, indices, data), so only the words that occur in a caption are stored and multiplied.
+## load_backend(path) loads either kind of model from its folder.
+
+import abc
+import hashlib
+import itertools
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .categories import CATEGORIES
+
+class ClassifierBackend(abc.ABC):
+  ## Interface of a classifier: name, model_id (used to key caches and incremental stores) and iter_batches()
+  ## A backend without iter_batches cannot be created (TypeError), so an incomplete backend fails before any caption is classified.
+  name = None
+  model_id = None
+
+  @abc.abstractmethod
+  def iter_batches(self, texts, batch_size=1000, n_process=1):
+    ## Yield float32 arrays of probabilities (batch x len(CATEGORIES)) for consecutive batches of texts (all strings)
+    raise NotImplementedError
+
+## Factories of spaCy text classification components
+TEXTCAT_FACTORIES = ("textcat", "textcat_multilabel")
+
+def textcat_components(nlp):
+  ## Name of the (first) textcat component of nlp, and the names of the components it needs in pipeline order: itself and any component it listens to (e.g. a shared tok2vec)
+  textcats = [name for name in nlp.pipe_names if nlp.get_pipe_meta(name).factory in TEXTCAT_FACTORIES]
+  if not textcats:
+    raise ValueError(f"The pipeline has no textcat component (components: {nlp.pipe_names})")
+  textcat = textcats[0]
+  needed = [name for name, pipe in nlp.pipeline if name == textcat or textcat in getattr(pipe, "listening_components", [])]
+  return textcat, needed
+
+class SpacyBackend(ClassifierBackend):
+  ## The trained spaCy textcat model. The probabilities are the scores of the textcat component (the values of doc.cats in Step 4 and Step 6 of 5a).
+  ## Only the textcat component and the components it listens to are run (other components, e.g. a tagger or parser, are skipped).
+  ## With n_process=1, the textcat scores of each batch are taken straight from the model as an array (TextCategorizer.predict) without setting doc.cats, and the Docs of the batch are dropped before the next batch is made,
+  ## so memory stays the same for any number of captions and there is no per-caption Python work around the model. With n_process > 1, nlp.pipe runs across processes and the scores are read from doc.cats.
+  name = "spacy"
+
+  def __init__(self, nlp, model_id=None):
+    self.nlp = nlp
+    self.model_id = model_id
+
+  @classmethod
+  def load(cls, model_path):
+    import spacy
+    from .cache import spacy_model_id
+    return cls(spacy.load(model_path), spacy_model_id(model_path))
+
+  def iter_batches(self, texts, batch_size=1000, n_process=1):
+    textcat, needed = textcat_components(self.nlp)
+    if n_process > 1:
+      yield from self._pipe_batches(texts, batch_size, n_process, [name for name in self.nlp.pipe_names if name not in needed])
+      return
+    pipe = self.nlp.get_pipe(textcat)
+    missing = [category for category in CATEGORIES if category not in pipe.labels]
+    if missing:
+      raise ValueError(f"The textcat component has no labels {missing}")
+    # Position of each of CATEGORIES among the labels (columns of the scores) of the textcat component
+    columns = [pipe.labels.index(category) for category in CATEGORIES]
+    before = [self.nlp.get_pipe(name) for name in needed if name != textcat]
+    texts = iter(texts)
+    while True:
+      batch = list(itertools.islice(texts, batch_size))
+      if not batch:
+        return
+      docs = list(self.nlp.tokenizer.pipe(batch, batch_size=batch_size))
+      for component in before:
+        docs = list(component.pipe(docs, batch_size=batch_size))
+      scores = pipe.model.ops.to_numpy(pipe.predict(docs))
+      del docs
+      yield np.asarray(scores[:, columns], dtype=np.float32)
+
+  def _pipe_batches(self, texts, batch_size, n_process, disable):
+    batch = []
+    for doc in self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=disable):
+      cats = doc.cats
+      batch.append([cats[category] for category in CATEGORIES])
+      if len(batch) == batch_size:
+        yield np.array(batch, dtype=np.float32)
+        batch = []
+    if batch:
+      yield np.array(batch, dtype=np.float32)
+
+def hashed_features(texts, n_features=2 ** 18, bigrams=True):
+  ## Sparse rows (indptr, indices, data) of hashed unigram (and bigram) counts of whitespace-separated words.
+  ## Counts are scaled as 1 + log(count) and each row is scaled to unit length. Texts that are NaN have no features.
+  texts = pd.Series(texts, dtype=object).reset_index(drop=True)
+  tokens = texts.where(texts.map(type).eq(str), "").str.split()
+  lengths = tokens.str.len().to_numpy()
+  words = np.fromiter((word for row in tokens for word in row), dtype=object, count=int(lengths.sum()))
+  rows = np.repeat(np.arange(len(texts)), lengths)
+  if bigrams and len(words) > 1:
+    # Pairs of consecutive words within the same caption
+    same_row = rows[:-1] == rows[1:]
+    words = np.concatenate([words, words[:-1][same_row] + " " + words[1:][same_row]])
+    rows = np.concatenate([rows, rows[:-1][same_row]])
+  columns = (pd.util.hash_array(words) % np.uint64(n_features)).astype(np.int64)
+  # Count repeated features within a row; np.unique also sorts the features by row
+  keys, counts = np.unique(rows * n_features + columns, return_counts=True)
+  rows, indices = np.divmod(keys, n_features)
+  data = 1 + np.log(counts)
+  norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=len(texts)))
+  data = (data / norms[rows]).astype(np.float32)
+  indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(texts)))])
+  return indptr, indices, data
+
+def _take_rows(features, rows):
+  ## Sparse rows of features at positions rows
+  indptr, indices, data = features
+  lengths = np.diff(indptr)[rows]
+  new_indptr = np.concatenate([[0], np.cumsum(lengths)])
+  positions = np.arange(new_indptr[-1]) - np.repeat(new_indptr[:-1] - indptr[rows], lengths)
+  return new_indptr, indices[positions], data[positions]
+
+def _sparse_dot(features, weights):
+  ## features @ weights, for sparse rows and a dense weight matrix
+  indptr, indices, data = features
+  out = np.zeros((len(indptr) - 1, weights.shape[1]), dtype=np.float64)
+  filled = np.diff(indptr) > 0
+  if filled.any():
+    out[filled] = np.add.reduceat(data[:, None] * weights[indices], indptr[:-1][filled], axis=0)
+  return out
+
+def _softmax(logits):
+  logits = logits - logits.max(axis=1, keepdims=True)
+  np.exp(logits, out=logits)
+  return logits / logits.sum(axis=1, keepdims=True)
+
+class HashedLogisticBackend(ClassifierBackend):
+  ## Multinomial logistic regression over hashed unigram/bigram features, trained with mini-batch Adam and an L2 penalty.
+  name = "hashed-logreg"
+
+  def __init__(self, n_features=2 ** 18, bigrams=True, weights=None, bias=None):
+    self.n_features = n_features
+    self.bigrams = bigrams
+    self.weights = np.zeros((n_features, len(CATEGORIES)), dtype=np.float32) if weights is None else weights
+    self.bias = np.zeros(len(CATEGORIES), dtype=np.float32) if bias is None else bias
+
+  @property
+  def model_id(self):
+    digest = hashlib.sha256(self.weights.tobytes() + self.bias.tobytes()).hexdigest()
+    return f"{self.name}:{self.n_features}:{int(self.bigrams)}:{digest[:16]}"
+
+  def fit(self, texts, categories, n_epochs=10, batch_size=256, learning_rate=0.05, l2=1e-6, seed=1234):
+    ## Train on cleaned captions and their categories (e.g. cleaned_text and category of the training data). Captions that are NaN are left out.
+    texts = pd.Series(texts, dtype=object).reset_index(drop=True)
+    categories = pd.Series(categories).reset_index(drop=True)
+    unknown = set(categories.dropna()) - set(CATEGORIES)
+    if unknown:
+      raise ValueError(f"Unknown categories: {sorted(unknown)}")
+    keep = (texts.map(type).eq(str) & categories.notna()).to_numpy()
+    features = hashed_features(texts[keep], self.n_features, self.bigrams)
+    targets = pd.Categorical(categories[keep], categories=CATEGORIES).codes.astype(np.int64)
+    weights = self.weights.astype(np.float64)
+    bias = self.bias.astype(np.float64)
+    # Adam moments. Only the rows of weights of features within a batch are updated (lazy Adam), so each step costs as much as the batch.
+    m_w, v_w = np.zeros_like(weights), np.zeros_like(weights)
+    m_b, v_b = np.zeros_like(bias), np.zeros_like(bias)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    rng = np.random.default_rng(seed)
+    step = 0
+    for _ in range(n_epochs):
+      order = rng.permutation(len(targets))
+      for start in range(0, len(order), batch_size):
+        rows = order[start:start + batch_size]
+        batch = _take_rows(features, rows)
+        indptr, indices, data = batch
+        # Gradient of the mean cross-entropy with respect to the logits
+        grad_logits = _softmax(_sparse_dot(batch, weights) + bias)
+        grad_logits[np.arange(len(rows)), targets[rows]] -= 1
+        grad_logits /= len(rows)
+        touched, inverse = np.unique(indices, return_inverse=True)
+        batch_rows = np.repeat(np.arange(len(rows)), np.diff(indptr))
+        grad_w = np.zeros((len(touched), len(CATEGORIES)))
+        contributions = data[:, None] * grad_logits[batch_rows]
+        for k in range(len(CATEGORIES)):
+          grad_w[:, k] = np.bincount(inverse, weights=contributions[:, k], minlength=len(touched))
+        grad_w += l2 * weights[touched]
+        grad_b = grad_logits.sum(axis=0)
+        step += 1
+        correction = np.sqrt(1 - beta2 ** step) / (1 - beta1 ** step)
+        m_w[touched] = beta1 * m_w[touched] + (1 - beta1) * grad_w
+        v_w[touched] = beta2 * v_w[touched] + (1 - beta2) * grad_w ** 2
+        weights[touched] -= learning_rate * correction * m_w[touched] / (np.sqrt(v_w[touched]) + eps)
+        m_b = beta1 * m_b + (1 - beta1) * grad_b
+        v_b = beta2 * v_b + (1 - beta2) * grad_b ** 2
+        bias -= learning_rate * correction * m_b / (np.sqrt(v_b) + eps)
+    self.weights = weights.astype(np.float32)
+    self.bias = bias.astype(np.float32)
+    return self
+
+  def iter_batches(self, texts, batch_size=1000, n_process=1):
+    ## n_process is not used: each batch is a few vectorized NumPy operations
+    for start in range(0, len(texts), batch_size):
+      features = hashed_features(texts[start:start + batch_size], self.n_features, self.bigrams)
+      yield _softmax(_sparse_dot(features, self.weights) + self.bias).astype(np.float32)
+
+  def save(self, path):
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    np.savez(path / "weights.npz", weights=self.weights, bias=self.bias)
+    with open(path / "meta.json", "w") as f:
+      json.dump({"backend": self.name, "n_features": self.n_features, "bigrams": self.bigrams, "categories": CATEGORIES}, f, indent=2)
+
+  @classmethod
+  def load(cls, path):
+    path = Path(path)
+    with open(path / "meta.json") as f:
+      meta = json.load(f)
+    if meta["categories"] != CATEGORIES:
+      raise ValueError(f"{path} was trained on different categories: {meta['categories']}")
+    arrays = np.load(path / "weights.npz")
+    return cls(meta["n_features"], meta["bigrams"], arrays["weights"], arrays["bias"])
+
+def load_backend(path):
+  ## Load the classifier saved in the folder path: a HashedLogisticBackend (meta.json with "backend": "hashed-logreg") or otherwise a spaCy model
+  meta_path = Path(path) / "meta.json"
+  if meta_path.exists():
+    with open(meta_path) as f:
+      if json.load(f).get("backend") == HashedLogisticBackend.name:
+        return HashedLogisticBackend.load(path)
+  return SpacyBackend.load(path)
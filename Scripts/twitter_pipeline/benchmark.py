@@ -0,0 +1,181 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - benchmarks
+
+## Description:
+## Benchmarks of the Python stages of 5a and 5b on synthetic #conservation posts (see synthetic.py), so that no data from Zenodo or network access is needed.
+## Stages: clean (caption cleaning), make_docs (DocBin training data), classify (spaCy textcat), thresholds (threshold sweep and ROC curves) and vader (sentiment scores).
+## The classify stage uses a tiny textcat model that is trained locally on synthetic posts.
+## Each stage runs in a fresh process, so that the peak memory (RSS) of one stage does not carry over to the next. Wall time, rows/sec and peak RSS are saved as JSON.
+## Usage (from the Scripts folder):
+## python -m twitter_pipeline.benchmark --sizes 1000 10000 100000 --out ../data/benchmarks/run.json
+## python -m twitter_pipeline.benchmark --sizes 1000 --compare ../data/benchmarks/run.json   # reports stages that became slower
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .categories import CATEGORIES
+from .instrument import peak_rss_mb
+
+STAGES = ['clean', 'make_docs', 'classify', 'thresholds', 'vader']
+
+def _rss_mb():
+  ## Current resident memory of this process in MB (Linux only, None elsewhere)
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+  except (OSError, ValueError, AttributeError):
+    return None
+
+def _reset_peak_rss():
+  ## Reset the peak memory of this process to its current memory (Linux only), so that the peak of a stage does not include the creation of its input
+  try:
+    with open('/proc/self/clear_refs', 'w') as f:
+      f.write('5')
+  except OSError:
+    pass
+
+def train_tiny_model(out_dir, n=2000, seed=1234, n_iter=3):
+  ## Train a small textcat model on synthetic posts and save it to out_dir
+  import spacy
+  from spacy.training import Example
+  from .cleaning import clean_texts
+  from .docs import category_table
+  from .synthetic import make_posts
+  posts = make_posts(n, seed)
+  texts = clean_texts(posts['Raw_Caption'])
+  table = category_table()
+  nlp = spacy.blank("en")
+  textcat = nlp.add_pipe("textcat")
+  for category in CATEGORIES:
+    textcat.add_label(category)
+  examples = [Example.from_dict(nlp.make_doc(text), {"cats": table[category]}) for text, category in zip(texts, posts['category'])]
+  optimizer = nlp.initialize(lambda: examples)
+  rng = np.random.default_rng(seed)
+  for _ in range(n_iter):
+    for start in range(0, len(examples), 256):
+      batch = [examples[i] for i in rng.permutation(len(examples))[start:start + 256]]
+      nlp.update(batch, sgd=optimizer)
+  nlp.to_disk(out_dir)
+  return Path(out_dir)
+
+def _stage_input(stage, n, seed):
+  from .cleaning import clean_texts
+  from .synthetic import make_posts, make_probs, make_pred_dicts
+  posts = make_posts(n, seed)
+  if stage in ('make_docs', 'classify'):
+    posts['cleaned_text'] = clean_texts(posts['Raw_Caption']).values
+  if stage == 'thresholds':
+    posts['pred_dict'] = make_pred_dicts(make_probs(posts['category'], seed)).values
+  return posts
+
+def _run_stage(stage, n, seed, workdir, model_path, n_process):
+  ## Runs in a fresh process: create the input and load models/imports (not timed), then time the stage
+  posts = _stage_input(stage, n, seed)
+  if stage == 'clean':
+    from .cleaning import clean_texts, get_stopwords
+    get_stopwords()
+    run = lambda: clean_texts(posts['Raw_Caption'], n_process=n_process)
+  elif stage == 'make_docs':
+    from .docs import build_training_corpora, make_tokenizer_nlp
+    nlp = make_tokenizer_nlp()
+    run = lambda: build_training_corpora(posts['cleaned_text'], posts['category'], Path(workdir) / f"docs_{n}", nlp=nlp)
+  elif stage == 'classify':
+    import spacy
+    from .classify import classify_texts
+    nlp = spacy.load(model_path)
+    run = lambda: classify_texts(nlp, posts['cleaned_text'], n_process=n_process)
+  elif stage == 'thresholds':
+    from .thresholds import parse_pred_dicts, threshold_sweep, roc_curves, roc_auc_scores
+    def run():
+      probs = parse_pred_dicts(posts['pred_dict'])
+      threshold_sweep(probs, posts['category'])
+      roc_auc_scores(roc_curves(probs, posts['category'], thresholds=np.linspace(0, 1, 1001)))
+  elif stage == 'vader':
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    from .sentiment import sentiment_frame
+    analyser = SentimentIntensityAnalyzer()
+    run = lambda: sentiment_frame(posts['Raw_Caption'], analyser=analyser, n_process=n_process)
+  else:
+    raise ValueError(f"Unknown stage {stage}, expected one of {STAGES}")
+  _reset_peak_rss()
+  start_rss = _rss_mb()
+  start = time.perf_counter()
+  run()
+  seconds = time.perf_counter() - start
+  return {
+    'stage': stage, 'n_rows': n, 'n_process': n_process, 'seconds': seconds,
+    'rows_per_sec': n / seconds if seconds > 0 else None,
+    'start_rss_mb': start_rss, 'peak_rss_mb': peak_rss_mb(),
+  }
+
+def run_benchmarks(sizes=(1000, 10000, 100000), stages=STAGES, seed=1234, n_process=1):
+  ## Run every stage at every size, each in a fresh process. Returns a dict with the environment and the results.
+  context = multiprocessing.get_context('spawn')
+  results = []
+  with tempfile.TemporaryDirectory() as workdir:
+    model_path = str(train_tiny_model(Path(workdir) / "tiny_model", seed=seed)) if 'classify' in stages else None
+    for stage in stages:
+      for n in sizes:
+        with context.Pool(1) as pool:
+          result = pool.apply(_run_stage, (stage, n, seed, workdir, model_path, n_process))
+        print(f"{stage:>10} {n:>9} rows: {result['seconds']:8.2f} s, {result['rows_per_sec'] or 0:12.0f} rows/s, peak RSS {result['peak_rss_mb'] or float('nan'):8.1f} MB")
+        results.append(result)
+  return {'environment': _environment(seed), 'results': results}
+
+def _environment(seed):
+  from importlib.metadata import version, PackageNotFoundError
+  packages = {}
+  for package in ['numpy', 'pandas', 'spacy', 'vaderSentiment', 'langdetect']:
+    try:
+      packages[package] = version(package)
+    except PackageNotFoundError:
+      packages[package] = None
+  return {
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'seed': seed, 'python': platform.python_version(),
+    'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'packages': packages,
+  }
+
+def compare_results(previous, current, tolerance=0.2):
+  ## List of (stage, n_rows, previous seconds, current seconds) for stages that are more than tolerance (20%) slower than in the previous run
+  previous_seconds = {(r['stage'], r['n_rows']): r['seconds'] for r in previous['results']}
+  slower = []
+  for r in current['results']:
+    key = (r['stage'], r['n_rows'])
+    if key in previous_seconds and r['seconds'] > previous_seconds[key] * (1 + tolerance):
+      slower.append((r['stage'], r['n_rows'], previous_seconds[key], r['seconds']))
+  return slower
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark the Twitter pipeline stages on synthetic posts.")
+  parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help="Numbers of posts (e.g. 1000 10000 100000 1000000 5000000)")
+  parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+  parser.add_argument('--seed', type=int, default=1234)
+  parser.add_argument('--n-process', type=int, default=1)
+  parser.add_argument('--out', type=Path, help="JSON file to save the results to")
+  parser.add_argument('--compare', type=Path, help="JSON file of an earlier run to compare against")
+  parser.add_argument('--tolerance', type=float, default=0.2)
+  args = parser.parse_args(argv)
+  results = run_benchmarks(args.sizes, args.stages, args.seed, args.n_process)
+  if args.out:
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.out, 'w') as f:
+      json.dump(results, f, indent=2)
+  if args.compare:
+    with open(args.compare) as f:
+      slower = compare_results(json.load(f), results, args.tolerance)
+    for stage, n, before, after in slower:
+      print(f"SLOWER: {stage} at {n} rows took {after:.2f} s (was {before:.2f} s)")
+    return 1 if slower else 0
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
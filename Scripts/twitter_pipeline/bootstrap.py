@@ -0,0 +1,113 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - bootstrap confidence intervals
+
+## Description:
+## Percentile bootstrap confidence intervals of the evaluation metrics of each category (Step 4 of 5a) and of the percentage of posts of each taxonomic group per year (as bootstrapped in 5d with sample_n(1500, replace = T)).
+## Categories are integer codes (see evaluation.py and loading.py). Every resample is reduced to the counts of each code (or each cell of the confusion matrix), and the metrics of all resamples are then calculated at once from an n_resamples x cells array.
+## Two ways of drawing the resamples are available:
+##   method="counts" (default): the counts of each cell are drawn directly from a multinomial distribution with the observed proportions. Drawing n items with replacement and counting them gives exactly this distribution,
+##     and it takes the same time for any number of posts (10,000 resamples of the full corpus take well under a second).
+##   method="indices": the resamples are drawn as matrices of row indices (batches of resamples x size), as sample_n does, and the codes at the indices are counted. The time grows with the number of posts.
+## Resamples are drawn in blocks of block_size resamples, each with its own seed from a SeedSequence of seed, so results are the same for the same seed whatever the number of processes (n_process).
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .categories import CATEGORIES
+from .evaluation import confusion_matrix, counts_from_matrix, encode_categories, metrics_from_counts
+
+## Largest number of indices drawn at once by method="indices"
+MAX_INDICES = 2 ** 24
+
+def percentile_interval(samples, ci=0.95, axis=0):
+  ## (lower, upper) percentile bounds of the samples of a statistic, e.g. the 2.5th and 97.5th percentiles for ci=0.95
+  alpha = (1 - ci) / 2 * 100
+  lower, upper = np.percentile(samples, [alpha, 100 - alpha], axis=axis)
+  return lower, upper
+
+def _resample_block(args):
+  ## Counts (n x n_cells) of n resamples of size items of codes
+  codes, n_cells, size, n, seed, method = args
+  rng = np.random.default_rng(seed)
+  if method == "counts":
+    counts = np.bincount(codes, minlength=n_cells)
+    return rng.multinomial(size, counts / counts.sum(), size=n)
+  if method != "indices":
+    raise ValueError(f"Unknown method {method!r}, use 'counts' or 'indices'")
+  out = np.empty((n, n_cells), dtype=np.int64)
+  batch_size = max(1, MAX_INDICES // max(size, 1))
+  for start in range(0, n, batch_size):
+    batch = min(batch_size, n - start)
+    indices = rng.integers(0, len(codes), size=(batch, size))
+    # Offset the codes of each resample so that a single bincount counts all resamples of the batch
+    offsets = np.arange(batch, dtype=np.int64)[:, None] * n_cells
+    out[start:start + batch] = np.bincount((codes[indices] + offsets).ravel(), minlength=batch * n_cells).reshape(batch, n_cells)
+  return out
+
+def resample_counts(codes, n_cells, n_resamples=10000, size=None, seed=1234, method="counts", n_process=1, block_size=1000):
+  ## n_resamples x n_cells array with the counts of each code (0 to n_cells - 1) in each resample of size items (default: as many items as codes) drawn with replacement
+  codes = np.asarray(codes, dtype=np.int64)
+  size = len(codes) if size is None else size
+  seeds = np.random.SeedSequence(seed).spawn((n_resamples + block_size - 1) // block_size)
+  blocks = [(codes, n_cells, size, min(block_size, n_resamples - k * block_size), block_seed, method) for k, block_seed in enumerate(seeds)]
+  if n_process <= 1 or len(blocks) <= 1:
+    counts = [_resample_block(block) for block in blocks]
+  else:
+    with ProcessPoolExecutor(max_workers=n_process) as pool:
+      counts = list(pool.map(_resample_block, blocks))
+  return np.concatenate(counts) if counts else np.empty((0, n_cells), dtype=np.int64)
+
+def _as_codes(values):
+  ## int codes of categories: integer arrays are used as they are, category names are encoded (see evaluation.py)
+  values = np.asarray(values)
+  if np.issubdtype(values.dtype, np.integer):
+    return values.astype(np.int64)
+  return encode_categories(values).astype(np.int64)
+
+def bootstrap_metrics(true_cat, pred_cat, n_resamples=10000, ci=0.95, seed=1234, method="counts", n_process=1, include_fpr=False):
+  ## Confidence intervals of the accuracy, precision, recall and specificity (and fpr) of each category, and of their macro and micro averages.
+  ## true_cat and pred_cat are int codes (position in CATEGORIES) or category names. Returns one row per category and metric: estimate (metric of the data), lower and upper.
+  true_codes, pred_codes = _as_codes(true_cat), _as_codes(pred_cat)
+  n = len(CATEGORIES) + 1
+  cells = resample_counts(true_codes * n + pred_codes, n * n, n_resamples, seed=seed, method=method, n_process=n_process)
+  matrices = np.concatenate([confusion_matrix(true_codes, pred_codes)[None], cells.reshape(-1, n, n)])
+  # Row 0 is the data itself, rows 1 to n_resamples are the resamples
+  counts = counts_from_matrix(matrices)
+  per_category = metrics_from_counts(*counts)
+  summed = metrics_from_counts(*(count.sum(axis=-1) for count in counts))
+  metric_names = ['accuracy', 'precision', 'recall', 'specificity'] + (['fpr'] if include_fpr else [])
+  rows = []
+  for metric in metric_names:
+    values = np.column_stack([per_category[metric], per_category[metric].mean(axis=1), summed[metric]])
+    lower, upper = percentile_interval(values[1:], ci)
+    for c, category in enumerate(CATEGORIES + ['macro', 'micro']):
+      rows.append({'category': category, 'metric': metric, 'estimate': values[0, c], 'lower': lower[c], 'upper': upper[c]})
+  return pd.DataFrame(rows)
+
+def bootstrap_shares(groups, categories, size=1500, n_resamples=10000, ci=0.95, seed=1234, method="counts", n_process=1, levels=None, group_name='Year', category_name='Category2'):
+  ## Confidence intervals of the percentage of posts of each category within each group (e.g. each year), for resamples of size posts per group (None: the number of posts of the group) drawn with replacement.
+  ## levels gives the categories and their order (default: the sorted categories); posts with a missing category are counted as their own category (NaN), as group_by does in R.
+  ## Returns one row per group and category: count and freq (percentage) of the data, and the mean, lower and upper percentage of the resamples.
+  groups = pd.Series(groups).reset_index(drop=True)
+  categories = pd.Series(categories).reset_index(drop=True)
+  levels = sorted(categories.dropna().unique()) if levels is None else list(levels)
+  codes = pd.Categorical(categories, categories=levels).codes.astype(np.int64)
+  has_missing = bool((codes < 0).any())
+  codes[codes < 0] = len(levels)
+  labels = levels + [np.nan] if has_missing else levels
+  rows = []
+  positions = pd.Series(np.arange(len(groups))).groupby(groups.to_numpy(), dropna=False, sort=True)
+  for g, (group, group_rows) in enumerate(positions):
+    group_codes = codes[group_rows.to_numpy()]
+    counts = np.bincount(group_codes, minlength=len(labels))
+    group_size = len(group_codes) if size is None else size
+    # Each group has its own seed, made from seed and the position of the group
+    resampled = resample_counts(group_codes, len(labels), n_resamples, group_size, seed=[seed, g], method=method, n_process=n_process) / group_size * 100
+    lower, upper = percentile_interval(resampled, ci)
+    mean = resampled.mean(axis=0)
+    for c, label in enumerate(labels):
+      rows.append({group_name: group, category_name: label, 'count': counts[c], 'freq': counts[c] / len(group_codes) * 100,
+                   'mean': mean[c], 'lower': lower[c], 'upper': upper[c]})
+  return pd.DataFrame(rows)
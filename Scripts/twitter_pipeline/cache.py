@@ -0,0 +1,153 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - prediction cache
+
+## Description:
+## Persistent cache of model outputs, so that identical captions (e.g. retweets, or posts that are in more than one yearly pull) are only run through a model once.
+## Entries are stored in a local SQLite file and keyed on a hash of the text together with the identity of the model (the hash of the model-best files, or the VADER version).
+## Texts are keyed exactly as they are, since the spaCy tokenizer keeps runs of whitespace as tokens (e.g. "whale  shark" and "whale shark" get different probabilities).
+## With normalize=True (for VADER, which splits captions on whitespace), whitespace is collapsed to single spaces first, so captions that only differ in their whitespace share an entry.
+## A new model therefore never reuses the outputs of an old model. When the cache holds more than max_entries, the least recently used entries are removed.
+## The number of cache hits and misses is counted, see PredictionCache.report().
+## score_unique runs a model (spaCy classification or VADER scores) over the distinct captions only, using the cache, and is shared by classify.py and sentiment.py.
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+def normalize_text(text):
+  ## Whitespace collapsed to single spaces and stripped. Only safe for models that split texts on whitespace (VADER), not for spaCy.
+  return ' '.join(str(text).split())
+
+def spacy_model_id(model_path):
+  ## Identity of a trained spaCy model: the name/version in meta.json and a hash of all files in the model folder
+  model_path = Path(model_path)
+  digest = hashlib.sha256()
+  for file in sorted(p for p in model_path.rglob('*') if p.is_file()):
+    digest.update(file.relative_to(model_path).as_posix().encode())
+    with open(file, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+        digest.update(block)
+  with open(model_path / 'meta.json') as f:
+    meta = json.load(f)
+  return f"spacy:{meta.get('name')}:{meta.get('version')}:{digest.hexdigest()[:16]}"
+
+def vader_model_id():
+  ## Identity of the VADER analyser: the installed version of vaderSentiment
+  from importlib.metadata import version
+  return f"vader:{version('vaderSentiment')}"
+
+class PredictionCache:
+  ## Usage:
+  ## with PredictionCache("data//prediction_cache.sqlite", spacy_model_id("data//spacy_model//model-best")) as cache:
+  ##   values = cache.get_many(texts)   # list with None for texts that are not in the cache
+  ##   cache.put_many(new_texts, new_values)
+  ## with PredictionCache("data//vader_cache.sqlite", vader_model_id(), normalize=True) as cache: ...
+
+  # Max number of parameters in one SQLite query
+  _QUERY_SIZE = 500
+
+  def __init__(self, path, model_id, max_entries=5_000_000, normalize=False):
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self.model_id = model_id
+    self.max_entries = max_entries
+    self.normalize = normalize
+    self.hits = 0
+    self.misses = 0
+    self._conn = sqlite3.connect(self.path)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, model TEXT, value TEXT, last_used INTEGER)")
+    self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+    self._conn.commit()
+
+  def key(self, text):
+    # The mode is part of the key, so exact and normalized entries of the same model are never mixed up
+    if self.normalize:
+      return hashlib.sha256(f"{self.model_id}\0normalized\0{normalize_text(text)}".encode()).hexdigest()
+    return hashlib.sha256(f"{self.model_id}\0exact\0{text}".encode()).hexdigest()
+
+  def get_many(self, texts):
+    ## Cached values of the texts, in the same order (None for texts that are not cached)
+    keys = [self.key(text) for text in texts]
+    found = {}
+    unique_keys = list(dict.fromkeys(keys))
+    for s in range(0, len(unique_keys), self._QUERY_SIZE):
+      batch = unique_keys[s:s + self._QUERY_SIZE]
+      rows = self._conn.execute(f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall()
+      found.update((key, json.loads(value)) for key, value in rows)
+    # Mark the entries that were found as recently used
+    now = time.time_ns()
+    self._conn.executemany("UPDATE cache SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+    self._conn.commit()
+    values = [found.get(key) for key in keys]
+    n_found = sum(value is not None for value in values)
+    self.hits += n_found
+    self.misses += len(values) - n_found
+    return values
+
+  def put_many(self, texts, values):
+    ## Add the values (lists of floats) of the texts to the cache, then remove the least recently used entries if the cache is full
+    now = time.time_ns()
+    self._conn.executemany("INSERT OR REPLACE INTO cache (key, model, value, last_used) VALUES (?, ?, ?, ?)",
+      [(self.key(text), self.model_id, json.dumps([float(v) for v in value]), now) for text, value in zip(texts, values)])
+    self._conn.commit()
+    self.evict()
+
+  def evict(self):
+    n_entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+    if n_entries > self.max_entries:
+      self._conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used LIMIT ?)", (n_entries - self.max_entries,))
+      self._conn.commit()
+
+  def report(self):
+    total = self.hits + self.misses
+    rate = self.hits / total if total else 0
+    return f"Cache {self.path} ({self.model_id}): {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate)"
+
+  def close(self):
+    self._conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+def score_unique(texts, iter_scores, n_columns, dtype=np.float64, cache=None, monitor=None):
+  ## N x n_columns array of the outputs of a model for texts (NaN rows for texts that are not strings). Each distinct text is only run through the model once.
+  ## iter_scores(texts) yields arrays of outputs for consecutive batches of a list of strings. With a PredictionCache, texts found in it are not run through the model, and new outputs are added to it.
+  ## With a StageMonitor (see instrument.py), progress is reported after every batch.
+  texts = pd.Series(texts, dtype=object).reset_index(drop=True)
+  is_text = texts.map(lambda text: isinstance(text, str)).to_numpy(dtype=bool)
+  scores = np.full((len(texts), n_columns), np.nan, dtype=dtype)
+  codes, unique_texts = pd.factorize(texts[is_text])
+  unique_scores = np.empty((len(unique_texts), n_columns), dtype=dtype)
+  if cache is None:
+    missing = np.arange(len(unique_texts))
+  else:
+    cached = cache.get_many(unique_texts)
+    missing = np.array([i for i, value in enumerate(cached) if value is None], dtype=np.int64)
+    for i, value in enumerate(cached):
+      if value is not None:
+        unique_scores[i] = value
+  if monitor is not None:
+    # Progress is counted in posts: each caption counts for all the posts that have it
+    n_posts = np.bincount(codes, minlength=len(unique_texts))
+    monitor.update(len(texts) - int(n_posts[missing].sum()))
+  if len(missing):
+    start = 0
+    for batch_scores in iter_scores([unique_texts[i] for i in missing]):
+      batch = missing[start:start + len(batch_scores)]
+      unique_scores[batch] = batch_scores
+      start += len(batch_scores)
+      if monitor is not None:
+        monitor.update(int(n_posts[batch].sum()))
+    if cache is not None:
+      cache.put_many([unique_texts[i] for i in missing], unique_scores[missing])
+  scores[is_text] = unique_scores[codes]
+  return scores
@@ -0,0 +1,11 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - taxonomic categories
+
+## Description:
+## The nine categories of the topic taxonomy, in the order that the trained spaCy textcat model returns them in doc.cats.
+## This order is used as the fixed column order wherever probabilities or integer codes of categories are stored.
+
+CATEGORIES = ["Insects", "Plants", "Other Invertebrate Groups", "Birds", "Fish", "Amphibians & Reptiles", "Mammals", "Undefined Groups", "Others"]
+
+## Integer code of each category (i.e. its position in CATEGORIES)
+CATEGORY_CODES = {category: code for code, category in enumerate(CATEGORIES)}
@@ -0,0 +1,118 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - bulk classification
+
+## Description:
+## Classification of #conservation posts with the trained spaCy classifier (Step 6 of 5a), or another classifier backend (see backends.py), in bulk.
+## Captions are streamed through the model in batches (only the textcat component, see SpacyBackend in backends.py; optionally across processes) and the probabilities of each batch are written into a preallocated float32 array.
+## The predicted category is the category with the highest probability, as in Step 6 of 5a. Captions that are NaN are assigned as "Others".
+## For long runs, classify_posts writes the results in chunks to a folder and, when re-run after a crash, continues from the last completed chunk.
+## The chunks are only reused for the same model (model_id) and the same captions; otherwise the folder is cleared and all chunks are classified again.
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .backends import ClassifierBackend, SpacyBackend
+from .cache import score_unique
+from .categories import CATEGORIES
+from .evaluation import average_metrics, evaluate_predictions
+
+def classify_texts(nlp, texts, batch_size=1000, n_process=1, cache=None, monitor=None):
+  ## Returns (probs, pred_cat): an N x 9 float32 array of probabilities (columns in CATEGORIES order, NaN for captions that are NaN) and an array of predicted categories.
+  ## nlp is the trained spaCy pipeline or any classifier backend (see backends.py).
+  ## Identical captions are only run through the model once. With a PredictionCache (see cache.py), captions that were classified before by the same model are not run through the model again.
+  ## With a StageMonitor (see instrument.py), progress is reported after every batch.
+  backend = nlp if isinstance(nlp, ClassifierBackend) else SpacyBackend(nlp)
+  probs = score_unique(texts, lambda unique_texts: backend.iter_batches(unique_texts, batch_size=batch_size, n_process=n_process), len(CATEGORIES), np.float32, cache, monitor)
+  return probs, predicted_categories(probs)
+
+def predicted_categories(probs):
+  ## Category with the highest probability in each row of probs, "Others" for rows without probabilities (NaN).
+  ## Ties go to the category that comes first in CATEGORIES (np.argmax returns the first maximum), so a tie always gives the same single category.
+  probs = np.asarray(probs)
+  has_probs = ~np.isnan(probs).all(axis=1)
+  pred_cat = np.full(len(probs), "Others", dtype=object)
+  if has_probs.any():
+    pred_cat[has_probs] = np.asarray(CATEGORIES, dtype=object)[probs[has_probs].argmax(axis=1)]
+  return pred_cat
+
+def evaluate_classifier(nlp, texts, true_cat, batch_size=1000, n_process=1):
+  ## Classify the test captions and evaluate the predictions against the manually assigned categories (Step 4 of 5a), timing the classification.
+  ## Returns (probs, eval_metrics, summary): summary has the macro and micro averages of the metrics with the model_id, the number of posts and the posts classified per second, so backends can be compared on accuracy and throughput.
+  ## The probabilities can be passed on to threshold_sweep and roc_curves (Step 5 of 5a).
+  backend = nlp if isinstance(nlp, ClassifierBackend) else SpacyBackend(nlp)
+  start = time.perf_counter()
+  probs, pred_cat = classify_texts(backend, texts, batch_size=batch_size, n_process=n_process)
+  seconds = time.perf_counter() - start
+  eval_metrics = evaluate_predictions(true_cat, pred_cat)
+  summary = average_metrics(eval_metrics)
+  summary.insert(0, "backend", backend.name)
+  summary.insert(1, "model_id", backend.model_id)
+  summary["n_posts"] = len(pred_cat)
+  summary["seconds"] = seconds
+  summary["posts_per_s"] = len(pred_cat) / seconds if seconds else np.nan
+  return probs, eval_metrics, summary
+
+def texts_digest(texts):
+  ## Hash of the captions in order (NaN captions included), to check that saved results belong to the same input
+  hashes = pd.util.hash_pandas_object(pd.Series(texts, dtype=object).reset_index(drop=True), index=False).to_numpy()
+  return hashlib.sha256(hashes.tobytes()).hexdigest()
+
+def _chunk_frame(probs, pred_cat, start):
+  chunk = pd.DataFrame(probs, columns=CATEGORIES)
+  chunk.insert(0, "Category", pred_cat)
+  chunk.insert(0, "row", np.arange(start, start + len(pred_cat)))
+  return chunk
+
+def classify_posts(nlp, texts, out_dir, chunk_size=100_000, batch_size=1000, n_process=1, cache=None, monitor=None):
+  ## Classify a column of captions chunk by chunk. Each completed chunk is saved as out_dir//chunk_XXXXX.csv; chunks that are already on disk are not classified again.
+  ## nlp is a classifier backend with a model_id (e.g. SpacyBackend(nlp, spacy_model_id(model_path)) or load_backend(model_path), see backends.py).
+  ## Returns a DataFrame (one row per caption, in input order) with the predicted "Category" and the probability of each category.
+  backend = nlp if isinstance(nlp, ClassifierBackend) else SpacyBackend(nlp)
+  if backend.model_id is None:
+    raise ValueError("classify_posts needs the model_id of the model to know which saved chunks it produced; pass SpacyBackend(nlp, spacy_model_id(model_path)) or load_backend(model_path)")
+  texts = pd.Series(texts).reset_index(drop=True)
+  out_dir = Path(out_dir)
+  out_dir.mkdir(parents=True, exist_ok=True)
+  # The manifest makes sure that we only resume a run of the same model over the same captions with the same chunk size
+  manifest = {"model_id": backend.model_id, "texts": texts_digest(texts), "n_rows": len(texts), "chunk_size": chunk_size, "categories": CATEGORIES}
+  manifest_path = out_dir / "manifest.json"
+  previous = None
+  if manifest_path.exists():
+    with open(manifest_path) as f:
+      previous = json.load(f)
+  if previous != manifest:
+    # Chunks of another model or other captions are removed so that they are not mixed into this run
+    stale = sorted(out_dir.glob("chunk_*.csv")) + sorted(out_dir.glob("chunk_*.tmp"))
+    if stale:
+      print(f"{out_dir} contains {len(stale)} chunks of a different model or input, removing them")
+    for path in stale:
+      path.unlink()
+    with open(manifest_path, "w") as f:
+      json.dump(manifest, f)
+
+  chunks = []
+  for k, start in enumerate(range(0, len(texts), chunk_size)):
+    chunk_path = out_dir / f"chunk_{k:05d}.csv"
+    if chunk_path.exists():
+      print(f"Chunk {k} already classified, skipping")
+      chunks.append(pd.read_csv(chunk_path))
+      if monitor is not None:
+        monitor.update(len(chunks[-1]))
+      continue
+    probs, pred_cat = classify_texts(backend, texts.iloc[start:start + chunk_size], batch_size=batch_size, n_process=n_process, cache=cache, monitor=monitor)
+    chunk = _chunk_frame(probs, pred_cat, start)
+    # Write to a temporary file first so that a crash while writing does not leave behind a half-written chunk
+    tmp_path = chunk_path.with_suffix(".tmp")
+    chunk.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, chunk_path)
+    chunks.append(chunk)
+
+  if not chunks:
+    return _chunk_frame(np.empty((0, len(CATEGORIES)), dtype=np.float32), np.empty(0, dtype=object), 0)
+  return pd.concat(chunks, ignore_index=True)
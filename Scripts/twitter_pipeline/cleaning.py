@@ -0,0 +1,78 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - caption cleaning
+
+## Description:
+## Cleaning of captions before they are passed to the spaCy classifier: remove non-alphabetical letters, change all to small caps and remove stopwords.
+## Rows that are not text (i.e. NaN, read in by pandas as float) are returned as "NA", same as the original loop in Step 1 of 5a.
+## The regex and small caps are done on whole columns at once (or on chunks of a column across processes), so the run time grows linearly with the number of posts.
+## Used for both the "text" column of the training data (Step 1 of 5a) and the "Cleaned_Caption" column of #conservation posts (Step 6 of 5a).
+
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+## Additional stopwords (i.e. the hashtag itself and names of conservation organisations) that are added on top of spaCy's English stopwords
+STOPWORDS_TO_ADD = {"save", "saving", "saved",  "conservation", "conserve", "conserving", "conserved", "intl", "conservationorg", "thewcs", "wwf", "natgeowild", "thenatureconservancy", "org", "ipbes", "ifaw", "ifawglobal", "seashepherdglobal", "seashepherd", "unbiodiversity", "verified"}
+
+NA_TEXT = "NA"
+
+@functools.lru_cache(maxsize=None)
+def get_stopwords():
+  ## spaCy's English stopwords with our additions. A new frozenset is returned so that spaCy's own STOP_WORDS is left untouched.
+  from spacy.lang.en.stop_words import STOP_WORDS
+  return frozenset(STOP_WORDS | STOPWORDS_TO_ADD)
+
+def clean_text_series(text, stopwords=None):
+  ## Clean a pandas Series of captions with vectorized string operations. Returns a Series of cleaned strings with a fresh RangeIndex.
+  if stopwords is None:
+    stopwords = get_stopwords()
+  text = pd.Series(text).reset_index(drop=True)
+  # Same check as type(text) == float in the original loop
+  is_float = text.map(type).eq(float)
+  to_clean = text[~is_float].astype(str)
+  # Remove all non-alphabetical letters and change all letters to small caps
+  text_lower = to_clean.str.replace('[^a-zA-Z]', ' ', regex=True).str.lower()
+  # Split the captions into tokens, remove stopwords and rejoin non-stopwords words together.
+  # A single pass over the token lists is faster than exploding the tokens and joining them back with groupby (see benchmark.py)
+  cleaned = [' '.join([word for word in tokens if word not in stopwords]) for tokens in text_lower.str.split()]
+  result = pd.Series(NA_TEXT, index=text.index, dtype=object)
+  result[to_clean.index] = cleaned
+  return result
+
+def _clean_chunk(args):
+  chunk, stopwords = args
+  return clean_text_series(chunk, stopwords)
+
+def clean_texts(text, n_process=1, chunk_size=200_000, stopwords=None, monitor=None):
+  ## Clean a column of captions, chunk_size rows at a time. With n_process > 1, the chunks are cleaned across a process pool.
+  ## The output is identical to the single process output and keeps the order of the input. With a StageMonitor (see instrument.py), progress is reported after every chunk.
+  if stopwords is None:
+    stopwords = get_stopwords()
+  text = pd.Series(text).reset_index(drop=True)
+  chunks = [(text.iloc[s:s + chunk_size], stopwords) for s in range(0, len(text), chunk_size)]
+  if n_process <= 1 or len(chunks) <= 1:
+    cleaned_chunks = map(_clean_chunk, chunks)
+    pool = None
+  else:
+    pool = ProcessPoolExecutor(max_workers=n_process)
+    cleaned_chunks = pool.map(_clean_chunk, chunks)
+  try:
+    cleaned = []
+    for chunk in cleaned_chunks:
+      cleaned.append(chunk)
+      if monitor is not None:
+        monitor.update(len(chunk))
+  finally:
+    if pool is not None:
+      pool.shutdown()
+  if not cleaned:
+    return pd.Series([], dtype=object)
+  return pd.concat(cleaned, ignore_index=True)
+
+def clean_frame(df, text_col='text', out_col='cleaned_text', **kwargs):
+  ## Convenience wrapper: returns a copy of df with the cleaned captions of text_col stored in out_col.
+  ## e.g. clean_frame(conservation_posts, 'Raw_Caption', 'Cleaned_Caption') for the posts classified in Step 6 of 5a.
+  df = df.copy()
+  df[out_col] = clean_texts(df[text_col], **kwargs).values
+  return df
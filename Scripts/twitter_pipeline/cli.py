@@ -0,0 +1,430 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - command line
+
+## Description:
+## Command line entry point for running each stage of 5a and 5b on its own: clean, build-docs, train, tune, train-hashed, evaluate, sweep-thresholds, bootstrap-shares, classify and sentiment.
+## Heavy libraries (spaCy training, models, VADER) are only imported by the stage that needs them, so e.g. running classify does not import or run training.
+## Each stage records a hash of its input files, model and settings in a state file (default data//pipeline_state.json).
+## When a stage is run again with the same inputs and settings and its outputs still exist, it is skipped (use --force to run it anyway).
+## Usage (from the project folder):
+## python Scripts//5e_Twitter_pipeline_cli.py clean --input data//twitter_spaCy_train_data.csv --out data//twitter_spaCy_train_data_cleaned.csv
+## python Scripts//5e_Twitter_pipeline_cli.py classify --model data//spacy_model//model-best --input Curated_Datasets//5_1_Twiiter.csv --out data//5_1_Twiiter_classified.csv
+## python Scripts//5e_Twitter_pipeline_cli.py <stage> --help for the options of each stage
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+DEFAULT_STATE = "data//pipeline_state.json"
+DEFAULT_LOG = "data//pipeline_log.jsonl"
+
+def _file_digest(path, known):
+  ## sha256 of a file. Digests are reused from known (the state file) when the size and modification time of the file are unchanged.
+  stat = path.stat()
+  key = str(path.resolve())
+  if key in known and known[key][:2] == [stat.st_size, stat.st_mtime_ns]:
+    return known[key][2]
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      digest.update(block)
+  known[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+  return digest.hexdigest()
+
+def content_hash(path, known=None):
+  ## Hash of the content of a file, or of all files within a folder (with their relative paths)
+  known = {} if known is None else known
+  path = Path(path)
+  if path.is_file():
+    return _file_digest(path, known)
+  if not path.exists():
+    raise FileNotFoundError(f"Input not found: {path}")
+  digest = hashlib.sha256()
+  for file in sorted(p for p in path.rglob('*') if p.is_file()):
+    digest.update(file.relative_to(path).as_posix().encode())
+    digest.update(_file_digest(file, known).encode())
+  return digest.hexdigest()
+
+def _load_state(state_path):
+  if Path(state_path).exists():
+    with open(state_path) as f:
+      return json.load(f)
+  return {"stages": {}, "files": {}}
+
+def _save_state(state, state_path):
+  state_path = Path(state_path)
+  state_path.parent.mkdir(parents=True, exist_ok=True)
+  tmp_path = state_path.with_suffix(".tmp")
+  with open(tmp_path, 'w') as f:
+    json.dump(state, f, indent=2)
+  os.replace(tmp_path, state_path)
+
+def run_stage(stage, inputs, params, outputs, run, state_path=DEFAULT_STATE, force=False):
+  ## Run run() unless the stage was already run with the same input hashes and params and all outputs exist. Returns True if the stage was run.
+  state = _load_state(state_path)
+  fingerprint = {
+    "inputs": {str(path): content_hash(path, state["files"]) for path in inputs},
+    "params": params,
+  }
+  key = f"{stage}:{';'.join(str(path) for path in outputs)}"
+  if not force and state["stages"].get(key) == fingerprint and all(Path(path).exists() for path in outputs):
+    print(f"[{stage}] inputs, model and settings unchanged, skipping (use --force to run again)")
+    _save_state(state, state_path)
+    return False
+  run()
+  state["stages"][key] = fingerprint
+  _save_state(state, state_path)
+  return True
+
+## Stages. Each function only imports the modules that its stage needs.
+
+def _monitor(args, stage, total):
+  from .instrument import StageMonitor
+  return StageMonitor(stage, total=total, log_path=args.log, profile=args.profile)
+
+def _clean(args):
+  import pandas as pd
+  from .cleaning import clean_texts
+  data = pd.read_csv(args.input)
+  with _monitor(args, "clean", len(data)) as monitor:
+    data[args.out_col] = clean_texts(data[args.text_col], n_process=args.n_process, monitor=monitor).values
+  Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+  data.to_csv(args.out, index=False)
+
+def _build_docs(args):
+  from .docs import build_training_corpora
+  from .loading import read_posts
+  data = read_posts(args.input, [args.text_col, args.label_col], category_columns=[args.label_col])
+  build_training_corpora(data[args.text_col], data[args.label_col], args.out_dir, valid_fraction=args.valid_fraction, seed=args.seed, shard_size=args.shard_size)
+
+def _train(args):
+  from spacy.cli.train import train
+  train(config_path=Path(args.config), output_path=Path(args.output), overrides={"paths.train": str(args.train), "paths.dev": str(args.dev)})
+
+def _load_grid(grid):
+  ## Search grid from a JSON string or the path of a JSON file
+  if grid is None:
+    return {}
+  if Path(grid).is_file():
+    with open(grid) as f:
+      return json.load(f)
+  return json.loads(grid)
+
+def _tune(args):
+  from .loading import read_posts
+  from .tuning import expand_grid, run_search
+  data = read_posts(args.input, [args.text_col, args.label_col], category_columns=[args.label_col])
+  grid = _load_grid(args.grid)
+  with _monitor(args, "tune", len(expand_grid(grid)) * args.k) as monitor:
+    board, _ = run_search(data[args.text_col], data[args.label_col], args.config, grid, args.out_dir, k=args.k, seed=args.seed,
+                          n_workers=args.n_workers, threads_per_job=args.threads_per_job, sort_by=args.sort_by, monitor=monitor)
+  print(board.to_string(max_cols=8))
+
+def _train_hashed(args):
+  from .backends import HashedLogisticBackend
+  from .loading import read_posts
+  data = read_posts(args.input, [args.text_col, args.label_col], category_columns=[args.label_col])
+  with _monitor(args, "train_hashed", len(data)) as monitor:
+    model = HashedLogisticBackend(n_features=args.n_features, bigrams=not args.no_bigrams)
+    model.fit(data[args.text_col], data[args.label_col], n_epochs=args.epochs, batch_size=args.batch_size, learning_rate=args.learning_rate, l2=args.l2, seed=args.seed)
+    monitor.update(len(data))
+  model.save(args.output)
+
+def _evaluate(args):
+  from .backends import load_backend
+  from .classify import classify_texts
+  from .evaluation import evaluate_predictions
+  from .loading import read_posts
+  from .thresholds import format_pred_dicts
+  test_data = read_posts(args.input, category_columns=[args.label_col])
+  backend = load_backend(args.model)
+  with _monitor(args, "evaluate", len(test_data)) as monitor:
+    probs, pred_cat = classify_texts(backend, test_data[args.text_col], batch_size=args.batch_size, n_process=args.n_process, monitor=monitor)
+  # Same format as "test_spaCy_twitter_eval.csv": the probabilities as a dict string (['NA'] for captions that are NaN) and the predicted category
+  test_data['pred_dict'] = format_pred_dicts(probs)
+  test_data['pred_cat'] = pred_cat
+  test_data.to_csv(args.out, index=False)
+  evaluate_predictions(test_data[args.label_col], test_data['pred_cat']).to_csv(args.metrics_out, index=False)
+  if args.ci_out:
+    from .bootstrap import bootstrap_metrics
+    bootstrap_metrics(test_data[args.label_col], test_data['pred_cat'], n_resamples=args.n_resamples, seed=args.seed).to_csv(args.ci_out, index=False)
+
+def _bootstrap_shares(args):
+  from .bootstrap import bootstrap_shares
+  from .loading import read_posts
+  posts = read_posts(args.input, [args.group_col, args.category_col], category_columns=[])
+  size = args.size if args.size > 0 else None
+  with _monitor(args, "bootstrap_shares", len(posts)) as monitor:
+    shares = bootstrap_shares(posts[args.group_col], posts[args.category_col], size=size, n_resamples=args.n_resamples, seed=args.seed,
+                              n_process=args.n_process, group_name=args.group_col, category_name=args.category_col)
+    monitor.update(len(posts))
+  shares.to_csv(args.out, index=False)
+
+def _sweep_thresholds(args):
+  import numpy as np
+  from .loading import read_posts
+  from .thresholds import parse_pred_dicts, threshold_sweep, roc_curves, roc_auc_scores
+  eval_data = read_posts(args.input, ['pred_dict', args.label_col], category_columns=[args.label_col])
+  with _monitor(args, "sweep_thresholds", len(eval_data)) as monitor:
+    probs = parse_pred_dicts(eval_data['pred_dict'])
+    thresholds = np.round(np.arange(args.start, args.stop, args.step), 10)
+    all_eval_metrics, summary_eval_metrics = threshold_sweep(probs, eval_data[args.label_col], thresholds)
+    roc = roc_curves(probs, eval_data[args.label_col], thresholds=np.linspace(0, 1, args.roc_points + 1))
+    monitor.update(len(eval_data))
+  all_eval_metrics.to_csv(args.out_all, index=False)
+  summary_eval_metrics.to_csv(args.out_summary, index=False)
+  roc.to_csv(args.roc_out, index=False)
+  roc_auc_scores(roc).to_csv(args.auc_out, index=False)
+
+def _input_columns(args, needed):
+  ## Columns to read from the input: all columns, or (with --keep-cols) only the columns the stage needs and the columns to keep in the output
+  if args.keep_cols is None:
+    return None
+  return list(dict.fromkeys([column for column in needed if column] + args.keep_cols))
+
+def _read_input(args, needed):
+  ## The input as a list of one DataFrame or, with --stream-rows, an iterator of DataFrames of that many rows (for files larger than memory)
+  from .loading import iter_posts, read_posts
+  columns = _input_columns(args, needed)
+  if args.stream_rows:
+    return iter_posts(args.input, columns, chunk_size=args.stream_rows)
+  return [read_posts(args.input, columns)]
+
+def _write_output(chunks, out):
+  ## Write the DataFrames one after another to a temporary file, which replaces out once all of them are written
+  import pandas as pd
+  out = Path(out)
+  out.parent.mkdir(parents=True, exist_ok=True)
+  tmp_path = out.with_suffix(".tmp")
+  pd.DataFrame().to_csv(tmp_path, index=False)
+  for k, chunk in enumerate(chunks):
+    chunk.to_csv(tmp_path, mode='w' if k == 0 else 'a', header=k == 0, index=False)
+  os.replace(tmp_path, out)
+
+def _classify_chunk(args, backend, posts, cache, store, monitor):
+  from .classify import classify_posts, classify_texts
+  if args.english_only:
+    from .langfilter import add_languages, is_english
+    posts = add_languages(posts, args.raw_col, n_process=args.n_process)
+    posts = posts[is_english(posts)].reset_index(drop=True)
+  kwargs = dict(batch_size=args.batch_size, n_process=args.n_process, cache=cache, monitor=monitor)
+  if store is not None:
+    # Incremental mode: only new or changed posts (or posts classified by another model) are classified
+    from .incremental import classify_incremental
+    posts["Category"] = classify_incremental(store, backend, backend.model_id, posts, args.id_col, args.text_col, **kwargs)["Category"].values
+  elif args.stream_rows:
+    posts["Category"] = classify_texts(backend, posts[args.text_col], **kwargs)[1]
+  else:
+    posts["Category"] = classify_posts(backend, posts[args.text_col], out_dir=args.chunk_dir, chunk_size=args.chunk_size, **kwargs)["Category"].values
+  return posts
+
+def _classify(args):
+  from contextlib import nullcontext
+  from .backends import load_backend
+  from .cache import PredictionCache
+  from .incremental import IncrementalStore
+  chunks = _read_input(args, [args.text_col, args.id_col, args.raw_col if args.english_only else None])
+  total = len(chunks[0]) if isinstance(chunks, list) else None
+  backend = load_backend(args.model)
+  with PredictionCache(args.cache, backend.model_id) as cache, _monitor(args, "classify", total) as monitor, \
+       (IncrementalStore(args.store) if args.id_col else nullcontext()) as store:
+    _write_output((_classify_chunk(args, backend, posts, cache, store, monitor) for posts in chunks), args.out)
+    print(cache.report())
+
+def _sentiment_chunk(args, posts, cache, store, monitor):
+  from .sentiment import sentiment_frame
+  if store is not None:
+    # Incremental mode: only new or changed posts are scored
+    from .incremental import sentiment_incremental
+    sentiments = sentiment_incremental(store, posts, args.id_col, args.text_col, cache=cache, n_process=args.n_process, monitor=monitor)
+  else:
+    sentiments = sentiment_frame(posts[args.text_col], cache=cache, n_process=args.n_process, monitor=monitor)
+  for column in sentiments:
+    posts[column] = sentiments[column].values
+  return posts
+
+def _sentiment(args):
+  from contextlib import nullcontext
+  from .cache import PredictionCache, vader_model_id
+  from .incremental import IncrementalStore
+  chunks = _read_input(args, [args.text_col, args.id_col])
+  total = len(chunks[0]) if isinstance(chunks, list) else None
+  with PredictionCache(args.cache, vader_model_id(), normalize=True) as cache, _monitor(args, "sentiment", total) as monitor, \
+       (IncrementalStore(args.store) if args.id_col else nullcontext()) as store:
+    _write_output((_sentiment_chunk(args, posts, cache, store, monitor) for posts in chunks), args.out)
+    print(cache.report())
+
+def build_parser():
+  parser = argparse.ArgumentParser(description="Run the stages of the Twitter pipeline (5a, 5b).")
+  parser.add_argument('--state', default=DEFAULT_STATE, help="State file with the hashes of each stage")
+  parser.add_argument('--log', default=DEFAULT_LOG, help="Log file for progress of the stages")
+  parser.add_argument('--profile', choices=['cprofile', 'sample'], help="Profile the stage")
+  parser.add_argument('--force', action='store_true', help="Run the stage even if nothing changed")
+  stages = parser.add_subparsers(dest='stage', required=True)
+
+  p = stages.add_parser('clean', help="Clean captions (Step 1 of 5a)")
+  p.add_argument('--input', default="data//twitter_spaCy_train_data.csv")
+  p.add_argument('--text-col', default='text')
+  p.add_argument('--out', default="data//twitter_spaCy_train_data_cleaned.csv")
+  p.add_argument('--out-col', default='cleaned_text')
+  p.add_argument('--n-process', type=int, default=1)
+
+  p = stages.add_parser('build-docs', help="Create train/valid DocBin shards (Step 2 of 5a)")
+  p.add_argument('--input', default="data//twitter_spaCy_train_data_cleaned.csv")
+  p.add_argument('--text-col', default='cleaned_text')
+  p.add_argument('--label-col', default='category')
+  p.add_argument('--out-dir', default="data//spacy_corpus")
+  p.add_argument('--valid-fraction', type=float, default=0.2)
+  p.add_argument('--seed', type=int, default=1234)
+  p.add_argument('--shard-size', type=int, default=10000)
+
+  p = stages.add_parser('train', help="Train the textcat model (Step 3 of 5a)")
+  p.add_argument('--config', default="data//config_modified.cfg")
+  p.add_argument('--train', default="data//spacy_corpus//train")
+  p.add_argument('--dev', default="data//spacy_corpus//valid")
+  p.add_argument('--output', default="data//spacy_model")
+
+  p = stages.add_parser('tune', help="k-fold cross-validation of textcat training over a grid of settings (see tuning.py)")
+  p.add_argument('--input', default="data//twitter_spaCy_train_data_cleaned.csv")
+  p.add_argument('--text-col', default='cleaned_text')
+  p.add_argument('--label-col', default='category')
+  p.add_argument('--config', default="data//config_modified.cfg")
+  p.add_argument('--grid', help='JSON (or a JSON file) of config overrides and their values, e.g. \'{"training.dropout": [0.1, 0.2], "training.optimizer.learn_rate": [0.001, 0.0001]}\'; "config" lists config files')
+  p.add_argument('--k', type=int, default=5, help="Number of folds")
+  p.add_argument('--seed', type=int, default=1234)
+  p.add_argument('--out-dir', default="data//spacy_tuning")
+  p.add_argument('--n-workers', type=int, help="Jobs run at a time (default: number of cores / --threads-per-job)")
+  p.add_argument('--threads-per-job', type=int, default=1)
+  p.add_argument('--sort-by', default='spacy_cats_score', help="Metric to rank the settings by")
+
+  p = stages.add_parser('train-hashed', help="Train the hashed bag-of-words logistic regression classifier (see backends.py)")
+  p.add_argument('--input', default="data//twitter_spaCy_train_data_cleaned.csv")
+  p.add_argument('--text-col', default='cleaned_text')
+  p.add_argument('--label-col', default='category')
+  p.add_argument('--output', default="data//hashed_model")
+  p.add_argument('--n-features', type=int, default=2 ** 18)
+  p.add_argument('--no-bigrams', action='store_true', help="Only use unigram features")
+  p.add_argument('--epochs', type=int, default=10)
+  p.add_argument('--batch-size', type=int, default=256)
+  p.add_argument('--learning-rate', type=float, default=0.05)
+  p.add_argument('--l2', type=float, default=1e-6)
+  p.add_argument('--seed', type=int, default=1234)
+
+  p = stages.add_parser('evaluate', help="Classify the test data and calculate evaluation metrics (Step 4 of 5a)")
+  p.add_argument('--model', default="data//spacy_model//model-best", help="spaCy model or hashed model folder")
+  p.add_argument('--input', default="data//twitter_spaCy_test_data.csv")
+  p.add_argument('--text-col', default='cleaned_text')
+  p.add_argument('--label-col', default='category')
+  p.add_argument('--out', default="data//test_spaCy_twitter_eval.csv")
+  p.add_argument('--metrics-out', default="data//test_spaCy_twitter_eval_metrics.csv")
+  p.add_argument('--ci-out', help="Also save bootstrap confidence intervals of the metrics to this file (see bootstrap.py)")
+  p.add_argument('--n-resamples', type=int, default=10000)
+  p.add_argument('--seed', type=int, default=1234)
+  p.add_argument('--batch-size', type=int, default=1000)
+  p.add_argument('--n-process', type=int, default=1)
+
+  p = stages.add_parser('sweep-thresholds', help="Evaluate probability thresholds and ROC curves (Step 5 of 5a)")
+  p.add_argument('--input', default="data//test_spaCy_twitter_eval.csv")
+  p.add_argument('--label-col', default='category')
+  p.add_argument('--start', type=float, default=0.10)
+  p.add_argument('--stop', type=float, default=1.0)
+  p.add_argument('--step', type=float, default=0.05)
+  p.add_argument('--roc-points', type=int, default=1000)
+  p.add_argument('--out-all', default="data//threshold_spaCy_all_eval_metrics_twitter.csv")
+  p.add_argument('--out-summary', default="data//threshold_spaCy_summary_eval_metrics_twitter.csv")
+  p.add_argument('--roc-out', default="data//threshold_spaCy_roc_twitter.csv")
+  p.add_argument('--auc-out', default="data//threshold_spaCy_auc_twitter.csv")
+
+  p = stages.add_parser('bootstrap-shares', help="Bootstrap confidence intervals of the percentage of posts of each taxonomic group per year (as in 5d)")
+  p.add_argument('--input', default="Curated_Datasets//5_1_Twiiter.csv")
+  p.add_argument('--group-col', default='Year')
+  p.add_argument('--category-col', default='Category2')
+  p.add_argument('--size', type=int, default=1500, help="Posts drawn per group in each resample (0: the number of posts of the group)")
+  p.add_argument('--n-resamples', type=int, default=10000)
+  p.add_argument('--seed', type=int, default=1234)
+  p.add_argument('--n-process', type=int, default=1)
+  p.add_argument('--out', default="data//5_1_Twiiter_bootstrap_shares.csv")
+
+  p = stages.add_parser('classify', help="Classify all #conservation posts (Step 6 of 5a)")
+  p.add_argument('--model', default="data//spacy_model//model-best", help="spaCy model or hashed model folder")
+  p.add_argument('--input', default="Curated_Datasets//5_1_Twiiter.csv")
+  p.add_argument('--text-col', default='Cleaned_Caption')
+  p.add_argument('--raw-col', default='Raw_Caption')
+  p.add_argument('--english-only', action='store_true', help="Filter out non-English posts (detected from --raw-col) first")
+  p.add_argument('--out', default="data//5_1_Twiiter_classified.csv")
+  p.add_argument('--chunk-dir', default="data//spacy_classified_posts")
+  p.add_argument('--chunk-size', type=int, default=100000)
+  p.add_argument('--batch-size', type=int, default=1000)
+  p.add_argument('--n-process', type=int, default=1)
+  p.add_argument('--cache', default="data//spacy_cache.sqlite")
+  p.add_argument('--id-col', help="Post ID column; when given, only new or changed posts are processed (incremental mode)")
+  p.add_argument('--store', default="data//incremental_store.sqlite", help="Store of earlier results for incremental mode")
+  p.add_argument('--keep-cols', nargs='*', help="Columns of the input to keep in the output (default: all). Only these and the columns the stage needs are read")
+  p.add_argument('--stream-rows', type=int, default=0, help="Read and process the input this many rows at a time (for files larger than memory)")
+
+  p = stages.add_parser('sentiment', help="VADER sentiment of captions (5b)")
+  p.add_argument('--input', default="Curated_Datasets//5_2_Twiiter_Insects.csv")
+  p.add_argument('--text-col', default='Raw_Caption')
+  p.add_argument('--out', default="data//5_2_Twiiter_Insects_sentiment.csv")
+  p.add_argument('--n-process', type=int, default=1)
+  p.add_argument('--cache', default="data//vader_cache.sqlite")
+  p.add_argument('--id-col', help="Post ID column; when given, only new or changed posts are processed (incremental mode)")
+  p.add_argument('--store', default="data//incremental_store.sqlite", help="Store of earlier results for incremental mode")
+  p.add_argument('--keep-cols', nargs='*', help="Columns of the input to keep in the output (default: all). Only these and the columns the stage needs are read")
+  p.add_argument('--stream-rows', type=int, default=0, help="Read and process the input this many rows at a time (for files larger than memory)")
+  return parser
+
+## Inputs and outputs of each stage, used to decide whether it needs to run again
+def _stage_files(args):
+  if args.stage == 'clean':
+    return [args.input], [args.out]
+  if args.stage == 'build-docs':
+    return [args.input], [Path(args.out_dir) / "train", Path(args.out_dir) / "valid"]
+  if args.stage == 'train':
+    return [args.config, args.train, args.dev], [Path(args.output) / "model-best"]
+  if args.stage == 'tune':
+    configs = _load_grid(args.grid).get('config', [])
+    return [args.input, args.config, *configs], [Path(args.out_dir) / "leaderboard.csv"]
+  if args.stage == 'train-hashed':
+    return [args.input], [Path(args.output) / "weights.npz"]
+  if args.stage == 'evaluate':
+    return [args.model, args.input], [args.out, args.metrics_out] + ([args.ci_out] if args.ci_out else [])
+  if args.stage == 'sweep-thresholds':
+    return [args.input], [args.out_all, args.out_summary, args.roc_out, args.auc_out]
+  if args.stage == 'bootstrap-shares':
+    return [args.input], [args.out]
+  if args.stage == 'classify':
+    return [args.model, args.input], [args.out]
+  if args.stage == 'sentiment':
+    return [args.input], [args.out]
+
+STAGE_FUNCTIONS = {
+  'clean': _clean, 'build-docs': _build_docs, 'train': _train, 'tune': _tune, 'train-hashed': _train_hashed, 'evaluate': _evaluate,
+  'sweep-thresholds': _sweep_thresholds, 'bootstrap-shares': _bootstrap_shares, 'classify': _classify, 'sentiment': _sentiment,
+}
+
+## Settings that do not change the outputs of a stage (only how fast it runs) are left out of its hash
+_NOT_HASHED = {'stage', 'state', 'log', 'profile', 'force', 'n_process', 'batch_size', 'chunk_size', 'chunk_dir', 'cache', 'store', 'stream_rows', 'n_workers', 'threads_per_job'}
+## Settings of _NOT_HASHED that do change the outputs of some stages, e.g. the mini-batch size of training changes the trained weights
+_HASHED_FOR_STAGE = {'train-hashed': {'batch_size'}}
+
+def _stage_params(args):
+  ## Settings of the stage that are part of its hash
+  hashed = _HASHED_FOR_STAGE.get(args.stage, set())
+  return {key: str(value) for key, value in sorted(vars(args).items()) if key not in _NOT_HASHED or key in hashed}
+
+def main(argv=None):
+  args = build_parser().parse_args(argv)
+  inputs, outputs = _stage_files(args)
+  params = _stage_params(args)
+  if args.stage == 'sentiment':
+    from importlib.metadata import version
+    params['vaderSentiment'] = version('vaderSentiment')
+  run_stage(args.stage, inputs, params, outputs, lambda: STAGE_FUNCTIONS[args.stage](args), args.state, args.force)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,115 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - training data for textcat
+
+## Description:
+## Creation of the train and valid spaCy files (DocBin) for training the textcat model (Step 2 of 5a).
+## Only the tokenizer is run on the texts, since the textcat model does not use the tags, parses or entities of the full en_core_web_sm pipeline.
+## The binary code of the categories (doc.cats) is taken from a one-hot table of CATEGORIES.
+## Docs are written to disk in shards of at most shard_size docs (shard_00000.spacy, shard_00001.spacy, ...), so that only one shard is held in memory at a time.
+## spaCy reads all .spacy files within a folder, so the folders can be used directly as paths.train and paths.dev when training.
+## For cross-validation, build_fold_corpora writes one train/valid pair of folders per fold (see tuning.py).
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .categories import CATEGORIES
+
+def category_table(categories=CATEGORIES):
+  ## One-hot code of each category, e.g. category_table()["Insects"] = {"Insects": 1, "Plants": 0, ...}
+  return {category: {c: int(c == category) for c in categories} for category in categories}
+
+def make_tokenizer_nlp(lang="en"):
+  ## Blank pipeline with only the tokenizer of the language
+  import spacy
+  return spacy.blank(lang)
+
+def iter_docs(texts, categories, nlp=None, batch_size=1000):
+  ## Yield a tokenized Doc with its cats for each (text, category)
+  if nlp is None:
+    nlp = make_tokenizer_nlp()
+  table = category_table()
+  categories = list(categories)
+  unknown = set(categories) - set(table)
+  if unknown:
+    raise ValueError(f"Categories not in the topic taxonomy: {sorted(map(str, unknown))}")
+  for doc, category in zip(nlp.tokenizer.pipe((str(text) for text in texts), batch_size=batch_size), categories):
+    doc.cats = dict(table[category])
+    yield doc
+
+def write_docbin_shards(docs, out_dir, shard_size=10000):
+  ## Write docs into DocBin files of at most shard_size docs. Returns the paths of the shards written.
+  from spacy.tokens import DocBin
+  out_dir = Path(out_dir)
+  out_dir.mkdir(parents=True, exist_ok=True)
+  # Remove shards from an earlier run, so that the folder only contains this corpus
+  for old_shard in out_dir.glob("shard_*.spacy"):
+    old_shard.unlink()
+  paths = []
+  doc_bin = DocBin()
+  for doc in docs:
+    doc_bin.add(doc)
+    if len(doc_bin) >= shard_size:
+      paths.append(_write_shard(doc_bin, out_dir, len(paths)))
+      doc_bin = DocBin()
+  if len(doc_bin) or not paths:
+    paths.append(_write_shard(doc_bin, out_dir, len(paths)))
+  return paths
+
+def _write_shard(doc_bin, out_dir, k):
+  path = out_dir / f"shard_{k:05d}.spacy"
+  doc_bin.to_disk(path)
+  return path
+
+def split_train_valid(categories, valid_fraction=0.2, seed=1234):
+  ## Deterministic split stratified by category: boolean array that is True for rows in the valid set.
+  ## Within each category, round(valid_fraction * n) rows are drawn with a seeded random generator, so the same data and seed always give the same split.
+  categories = pd.Series(categories).reset_index(drop=True)
+  rng = np.random.default_rng(seed)
+  is_valid = np.zeros(len(categories), dtype=bool)
+  for category in CATEGORIES:
+    rows = np.flatnonzero(categories.to_numpy() == category)
+    n_valid = int(round(valid_fraction * len(rows)))
+    is_valid[rng.permutation(rows)[:n_valid]] = True
+  return is_valid
+
+def build_training_corpora(texts, categories, out_dir, valid_fraction=0.2, seed=1234, shard_size=10000, nlp=None, batch_size=1000):
+  ## Write out_dir//train and out_dir//valid folders of DocBin shards. With valid_fraction=0, the same data is written to both (as was done for the published model).
+  texts = pd.Series(texts).reset_index(drop=True)
+  categories = pd.Series(categories).reset_index(drop=True)
+  out_dir = Path(out_dir)
+  if valid_fraction > 0:
+    is_valid = split_train_valid(categories, valid_fraction, seed)
+    is_train = ~is_valid
+  else:
+    is_valid = is_train = np.ones(len(texts), dtype=bool)
+  write_docbin_shards(iter_docs(texts[is_train], categories[is_train], nlp, batch_size), out_dir / "train", shard_size)
+  write_docbin_shards(iter_docs(texts[is_valid], categories[is_valid], nlp, batch_size), out_dir / "valid", shard_size)
+  return out_dir / "train", out_dir / "valid"
+
+def assign_folds(categories, k=5, seed=1234):
+  ## Deterministic k-fold split stratified by category: int8 array with the fold (0 to k - 1) of each row.
+  ## Within each category, the rows are shuffled with a seeded random generator and dealt out to the folds in turn, so every fold has about 1/k of each category.
+  categories = pd.Series(categories).reset_index(drop=True)
+  rng = np.random.default_rng(seed)
+  folds = np.zeros(len(categories), dtype=np.int8)
+  for category in CATEGORIES:
+    rows = np.flatnonzero(categories.to_numpy() == category)
+    folds[rng.permutation(rows)] = np.arange(len(rows)) % k
+  return folds
+
+def build_fold_corpora(texts, categories, out_dir, k=5, seed=1234, shard_size=10000, nlp=None, batch_size=1000):
+  ## Write out_dir//fold_0 ... out_dir//fold_{k-1}, each with a train folder (the other k - 1 folds) and a valid folder (this fold) of DocBin shards.
+  ## Returns the paths of the fold folders.
+  texts = pd.Series(texts).reset_index(drop=True)
+  categories = pd.Series(categories).reset_index(drop=True)
+  folds = assign_folds(categories, k, seed)
+  fold_dirs = []
+  for fold in range(k):
+    fold_dir = Path(out_dir) / f"fold_{fold}"
+    is_valid = folds == fold
+    write_docbin_shards(iter_docs(texts[~is_valid], categories[~is_valid], nlp, batch_size), fold_dir / "train", shard_size)
+    write_docbin_shards(iter_docs(texts[is_valid], categories[is_valid], nlp, batch_size), fold_dir / "valid", shard_size)
+    fold_dirs.append(fold_dir)
+  return fold_dirs
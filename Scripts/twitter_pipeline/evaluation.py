@@ -0,0 +1,82 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - evaluation metrics
+
+## Description:
+## Evaluation of the classifier against manually assigned categories (Step 4 and Step 5 of 5a).
+## Categories are converted to integer codes (position in CATEGORIES) and the full confusion matrix is counted in one pass with np.bincount.
+## TP, FP, TN and FN of every category, and the accuracy, precision, recall, specificity and false positive rate (fpr), are then calculated from the matrix.
+## Any division by zero gives a metric of 0, as in the original loop.
+
+import numpy as np
+import pandas as pd
+
+from .categories import CATEGORIES
+
+METRIC_COLUMNS = ['category', 'TP', 'FP', 'TN', 'FN', 'accuracy', 'precision', 'recall', 'specificity']
+
+def encode_categories(values):
+  ## Convert category names to int8 codes. Values that are not one of the nine categories (e.g. NaN) are given the code len(CATEGORIES).
+  codes = pd.Categorical(np.asarray(values, dtype=object), categories=CATEGORIES).codes.astype(np.int8)
+  codes[codes < 0] = len(CATEGORIES)
+  return codes
+
+def decode_categories(codes):
+  ## Convert int8 codes back to category names (code len(CATEGORIES) is returned as NaN)
+  names = np.asarray(CATEGORIES + [np.nan], dtype=object)
+  return names[np.asarray(codes, dtype=np.int64)]
+
+def confusion_matrix(true_codes, pred_codes):
+  ## (n + 1) x (n + 1) matrix of counts, rows are the true categories and columns the predicted categories. The last row/column counts values that are not one of the categories.
+  n = len(CATEGORIES) + 1
+  true_codes = np.asarray(true_codes, dtype=np.int64)
+  pred_codes = np.asarray(pred_codes, dtype=np.int64)
+  return np.bincount(true_codes * n + pred_codes, minlength=n * n).reshape(n, n)
+
+def _safe_divide(numerator, denominator):
+  numerator = np.asarray(numerator, dtype=float)
+  denominator = np.asarray(denominator, dtype=float)
+  out = np.zeros(np.broadcast(numerator, denominator).shape)
+  np.divide(numerator, denominator, out=out, where=denominator != 0)
+  return out
+
+def counts_from_matrix(matrix):
+  ## TP, FP, TN and FN of every category (arrays of length 9). A stack of matrices (e.g. one per threshold, shape T x 10 x 10) gives arrays of shape T x 9.
+  total = matrix.sum(axis=(-2, -1))[..., None]
+  k = len(CATEGORIES)
+  TP = np.diagonal(matrix, axis1=-2, axis2=-1)[..., :k]
+  FP = matrix[..., :, :k].sum(axis=-2) - TP
+  FN = matrix[..., :k, :].sum(axis=-1) - TP
+  TN = total - TP - FP - FN
+  return TP, FP, TN, FN
+
+def metrics_from_counts(TP, FP, TN, FN):
+  ## Dict of accuracy, precision, recall, specificity and fpr arrays
+  return {
+    'accuracy': _safe_divide(TP + TN, TP + TN + FP + FN), # % of correct predictions
+    'precision': _safe_divide(TP, TP + FP), # % of positive predictions correct
+    'recall': _safe_divide(TP, TP + FN), # % of correct positive predictions
+    'specificity': _safe_divide(TN, TN + FP), # % of correct negative predictions
+    'fpr': _safe_divide(FP, FP + TN),
+  }
+
+def evaluate_predictions(true_cat, pred_cat, include_fpr=False):
+  ## One row per category with the same columns as "test_spaCy_twitter_eval_metrics.csv" (and the fpr column of the threshold evaluation when include_fpr is True)
+  matrix = confusion_matrix(encode_categories(true_cat), encode_categories(pred_cat))
+  return metrics_frame(*counts_from_matrix(matrix), include_fpr=include_fpr)
+
+def metrics_frame(TP, FP, TN, FN, include_fpr=False):
+  metrics = metrics_from_counts(TP, FP, TN, FN)
+  eval_metrics = pd.DataFrame({'category': CATEGORIES, 'TP': TP, 'FP': FP, 'TN': TN, 'FN': FN})
+  for column in METRIC_COLUMNS[5:] + (['fpr'] if include_fpr else []):
+    eval_metrics[column] = metrics[column]
+  return eval_metrics
+
+def average_metrics(eval_metrics):
+  ## Macro (mean of the per-category metrics) and micro (metrics of the summed TP, FP, TN and FN) averages, returned as two rows with category "macro" and "micro"
+  counts = eval_metrics[['TP', 'FP', 'TN', 'FN']]
+  metric_columns = [c for c in eval_metrics.columns if c not in ['category', 'TP', 'FP', 'TN', 'FN', 'threshold']]
+  macro = {'category': 'macro', **counts.mean().to_dict(), **eval_metrics[metric_columns].mean().to_dict()}
+  summed = counts.sum()
+  micro_metrics = metrics_from_counts(*(summed[c] for c in ['TP', 'FP', 'TN', 'FN']))
+  micro = {'category': 'micro', **summed.to_dict(), **{c: float(micro_metrics[c]) for c in metric_columns}}
+  return pd.DataFrame([macro, micro], columns=[c for c in eval_metrics.columns if c != 'threshold'])
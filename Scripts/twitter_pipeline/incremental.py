@@ -0,0 +1,124 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - incremental classification and sentiment
+
+## Description:
+## Incremental mode for new pulls of #conservation posts: results are kept in an indexed SQLite store keyed by post ID, together with the model that produced them and a hash of the caption.
+## Given a new export, only posts that are new, whose caption changed, or that were classified/scored by another model are run through the model. All other results are taken from the store.
+## Each stage (classification, sentiment) has its own table, so a new model-best only invalidates the classification results and not the sentiment scores.
+## Usage:
+## with IncrementalStore("data//incremental_store.sqlite") as store:
+##   classified_posts = classify_incremental(store, nlp, spacy_model_id(model_path), posts, id_col="Row_ID")
+##   sentiments = sentiment_incremental(store, posts, id_col="Row_ID")
+
+import hashlib
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .categories import CATEGORIES
+from .sentiment import SCORE_COLUMNS
+
+## Value columns of the table of each stage
+STAGE_COLUMNS = {
+  'classification': [f"p{code}" for code in range(len(CATEGORIES))],
+  'sentiment': SCORE_COLUMNS,
+}
+
+def text_hashes(texts):
+  ## sha1 of each caption (NaN captions are hashed as an empty marker, so they are also only processed once)
+  return np.array([hashlib.sha1(text.encode()).hexdigest() if isinstance(text, str) else "nan" for text in texts], dtype=object)
+
+class IncrementalStore:
+  # Max number of parameters in one SQLite query
+  _QUERY_SIZE = 500
+
+  def __init__(self, path):
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self._conn = sqlite3.connect(self.path)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    for stage, columns in STAGE_COLUMNS.items():
+      value_columns = ', '.join(f"{column} REAL" for column in columns)
+      self._conn.execute(f"CREATE TABLE IF NOT EXISTS {stage} (post_id TEXT PRIMARY KEY, model_id TEXT, text_hash TEXT, {value_columns})")
+      self._conn.execute(f"CREATE INDEX IF NOT EXISTS {stage}_model_id ON {stage} (model_id)")
+    self._conn.commit()
+
+  def load(self, stage):
+    ## All stored results of a stage as a DataFrame indexed by post_id
+    return pd.read_sql_query(f"SELECT * FROM {stage}", self._conn, index_col='post_id')
+
+  def lookup(self, stage, post_ids):
+    ## Stored results of a stage for the given post IDs only (looked up in the post_id index), as a DataFrame indexed by post_id in the order of post_ids (NaN for posts that are not stored)
+    post_ids = list(post_ids)
+    frames = []
+    for s in range(0, len(post_ids), self._QUERY_SIZE):
+      batch = post_ids[s:s + self._QUERY_SIZE]
+      frames.append(pd.read_sql_query(f"SELECT * FROM {stage} WHERE post_id IN ({','.join('?' * len(batch))})", self._conn, params=batch, index_col='post_id'))
+    columns = ['model_id', 'text_hash'] + STAGE_COLUMNS[stage]
+    stored = pd.concat(frames) if frames else pd.DataFrame(columns=columns)
+    return stored.reindex(index=post_ids, columns=columns)
+
+  def upsert(self, stage, post_ids, model_id, hashes, values):
+    columns = ['post_id', 'model_id', 'text_hash'] + STAGE_COLUMNS[stage]
+    rows = [(post_id, model_id, text_hash, *map(float, row)) for post_id, text_hash, row in zip(post_ids, hashes, values)]
+    self._conn.executemany(f"INSERT OR REPLACE INTO {stage} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+    self._conn.commit()
+
+  def invalidate(self, stage, model_id):
+    ## Remove the results of a stage that were produced by any other model than model_id. Returns the number of removed results.
+    # Written as two ranges so that the model_id index is used and a store without results of other models is not scanned
+    removed = self._conn.execute(f"DELETE FROM {stage} WHERE model_id < ? OR model_id > ?", (model_id, model_id)).rowcount
+    self._conn.commit()
+    return removed
+
+  def close(self):
+    self._conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+def update_incremental(store, stage, model_id, post_ids, texts, score):
+  ## N x k array of the results of stage for the posts, in input order. score(texts) is only called for posts that are new, changed or from another model.
+  ## Returns (values, n_processed).
+  post_ids = pd.Series(post_ids).astype(str).reset_index(drop=True)
+  if post_ids.duplicated().any():
+    raise ValueError(f"Post IDs must be unique, found {post_ids.duplicated().sum()} duplicates")
+  texts = pd.Series(texts).reset_index(drop=True)
+  hashes = text_hashes(texts)
+  columns = STAGE_COLUMNS[stage]
+  # Only the results of these posts are read, so each update costs time in proportion to the new export and not to the whole history in the store
+  stored = store.lookup(stage, post_ids)
+  is_valid = (stored['model_id'].to_numpy() == model_id) & (stored['text_hash'].to_numpy() == hashes)
+  values = stored[columns].to_numpy(dtype=float, copy=True)
+  todo = np.flatnonzero(~is_valid)
+  if len(todo):
+    new_values = np.asarray(score(texts.iloc[todo]), dtype=float)
+    values[todo] = new_values
+    store.upsert(stage, post_ids.iloc[todo], model_id, hashes[todo], new_values)
+  print(f"[{stage}] {len(todo)} new or changed posts processed, {len(post_ids) - len(todo)} taken from {store.path}")
+  return values, len(todo)
+
+def classify_incremental(store, nlp, model_id, posts, id_col, text_col="Cleaned_Caption", **kwargs):
+  ## Classify only the new or changed posts. Returns a DataFrame with the post IDs, the predicted "Category" and the probability of each category.
+  ## Results of earlier models are removed from the store first.
+  from .classify import classify_texts, predicted_categories
+  store.invalidate('classification', model_id)
+  probs, _ = update_incremental(store, 'classification', model_id, posts[id_col], posts[text_col], lambda texts: classify_texts(nlp, texts, **kwargs)[0])
+  classified_posts = pd.DataFrame(probs, columns=CATEGORIES)
+  classified_posts.insert(0, "Category", predicted_categories(probs))
+  classified_posts.insert(0, id_col, posts[id_col].to_numpy())
+  return classified_posts
+
+def sentiment_incremental(store, posts, id_col, text_col="Raw_Caption", model_id=None, **kwargs):
+  ## VADER scores of only the new or changed posts. Returns the same columns as sentiment_frame.
+  from .cache import vader_model_id
+  from .sentiment import score_captions, sentiment_columns
+  model_id = model_id or vader_model_id()
+  store.invalidate('sentiment', model_id)
+  scores, _ = update_incremental(store, 'sentiment', model_id, posts[id_col], posts[text_col], lambda texts: score_captions(texts, **kwargs))
+  return sentiment_columns(scores)
@@ -0,0 +1,155 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - progress and profiling of stages
+
+## Description:
+## StageMonitor wraps a stage (e.g. cleaning, classification, threshold sweep, VADER) and reports the rows processed, rows/sec, ETA and peak memory while it runs.
+## Progress is also written as JSON lines to a log file (e.g. data//pipeline_log.jsonl), one line per batch of rows (at most one every log_every seconds), so that slow batches and regressions can be found after the run.
+## Profiling of a stage can be switched on with profile="cprofile" (saves a .prof file, view with python -m pstats or snakeviz)
+## or profile="sample" (samples the stack every few ms and saves collapsed stacks that can be turned into a flame graph).
+## The TWITTER_PIPELINE_PROFILE environment variable sets the profile for all stages without changing the scripts.
+## Usage:
+## with StageMonitor("classify", total=len(texts), log_path="data//pipeline_log.jsonl") as monitor:
+##   for batch in batches:
+##     ...
+##     monitor.update(len(batch))
+
+import collections
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+def peak_rss_mb():
+  ## Peak resident memory of this process in MB: VmHWM on Linux, ru_maxrss on other Unix systems and None elsewhere (e.g. Windows)
+  try:
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1]) / 2**10
+  except OSError:
+    pass
+  try:
+    import resource
+  except ImportError:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in bytes on macOS and in KB on Linux
+  return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+class _StackSampler(threading.Thread):
+  ## Samples the stack of a thread every interval seconds and counts the collapsed stacks ("file:function;file:function;...")
+  def __init__(self, thread_id, interval=0.005):
+    super().__init__(daemon=True)
+    self.thread_id = thread_id
+    self.interval = interval
+    self.counts = collections.Counter()
+    self._stop_event = threading.Event()
+
+  def run(self):
+    while not self._stop_event.wait(self.interval):
+      frame = sys._current_frames().get(self.thread_id)
+      stack = []
+      while frame is not None:
+        stack.append(f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}")
+        frame = frame.f_back
+      if stack:
+        self.counts[';'.join(reversed(stack))] += 1
+
+  def stop(self):
+    self._stop_event.set()
+    self.join()
+
+class StageMonitor:
+  def __init__(self, stage, total=None, log_path=None, report_every=10.0, log_every=1.0, profile=None, profile_dir="data//profiles", quiet=False):
+    self.stage = stage
+    self.total = total
+    self.log_path = Path(log_path) if log_path else None
+    self.report_every = report_every
+    self.log_every = log_every
+    self.profile = profile or os.environ.get("TWITTER_PIPELINE_PROFILE") or None
+    if self.profile not in (None, "cprofile", "sample"):
+      raise ValueError(f"profile must be None, 'cprofile' or 'sample', got {self.profile!r}")
+    self.profile_dir = Path(profile_dir)
+    self.quiet = quiet
+    self.rows = 0
+    self._batch_rows = 0
+    self._log = None
+    self._profiler = None
+    self._sampler = None
+
+  def __enter__(self):
+    if self.log_path:
+      self.log_path.parent.mkdir(parents=True, exist_ok=True)
+      self._log = open(self.log_path, 'a')
+    self.start_time = self._batch_time = self._last_report = time.perf_counter()
+    self._write({'event': 'start'})
+    if self.profile == "cprofile":
+      self._profiler = cProfile.Profile()
+      self._profiler.enable()
+    elif self.profile == "sample":
+      self._sampler = _StackSampler(threading.get_ident())
+      self._sampler.start()
+    return self
+
+  def update(self, n_rows):
+    ## Record n_rows processed rows. Updates that come within log_every seconds of each other are logged together as one batch.
+    now = time.perf_counter()
+    self.rows += n_rows
+    self._batch_rows += n_rows
+    batch_seconds = now - self._batch_time
+    if batch_seconds < self.log_every:
+      return
+    record = self._progress(now)
+    record.update({'event': 'batch', 'batch_rows': self._batch_rows, 'batch_seconds': batch_seconds,
+                   'batch_rows_per_sec': self._batch_rows / batch_seconds if batch_seconds > 0 else None})
+    self._batch_time = now
+    self._batch_rows = 0
+    self._write(record)
+    if not self.quiet and now - self._last_report >= self.report_every:
+      self._last_report = now
+      print(self._format(record), file=sys.stderr, flush=True)
+
+  def __exit__(self, exc_type, exc, tb):
+    if self._profiler is not None:
+      self._profiler.disable()
+      self.profile_dir.mkdir(parents=True, exist_ok=True)
+      self._profiler.dump_stats(self.profile_dir / f"{self.stage}.prof")
+    if self._sampler is not None:
+      self._sampler.stop()
+      self.profile_dir.mkdir(parents=True, exist_ok=True)
+      with open(self.profile_dir / f"{self.stage}.collapsed", 'w') as f:
+        for stack, count in self._sampler.counts.most_common():
+          f.write(f"{stack} {count}\n")
+    record = self._progress(time.perf_counter())
+    record['event'] = 'end' if exc_type is None else 'error'
+    self._write(record)
+    if not self.quiet:
+      print(self._format(record), file=sys.stderr, flush=True)
+    if self._log is not None:
+      self._log.close()
+      self._log = None
+    return False
+
+  def _progress(self, now):
+    elapsed = now - self.start_time
+    rows_per_sec = self.rows / elapsed if elapsed > 0 else None
+    eta = None
+    if self.total is not None and rows_per_sec:
+      eta = max(self.total - self.rows, 0) / rows_per_sec
+    return {'rows': self.rows, 'total': self.total, 'elapsed_seconds': elapsed, 'rows_per_sec': rows_per_sec,
+            'eta_seconds': eta, 'peak_rss_mb': peak_rss_mb()}
+
+  def _format(self, record):
+    total = f"/{record['total']}" if record['total'] is not None else ""
+    rate = f"{record['rows_per_sec']:.0f} rows/s" if record['rows_per_sec'] else "- rows/s"
+    eta = f", ETA {record['eta_seconds']:.0f} s" if record['eta_seconds'] is not None and record['event'] == 'batch' else ""
+    memory = f", peak {record['peak_rss_mb']:.0f} MB" if record['peak_rss_mb'] is not None else ""
+    return f"[{self.stage}] {record['event']}: {record['rows']}{total} rows, {record['elapsed_seconds']:.1f} s, {rate}{eta}{memory}"
+
+  def _write(self, record):
+    if self._log is not None:
+      self._log.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stage': self.stage, **record}) + "\n")
+      self._log.flush()
@@ -0,0 +1,86 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - language filter
+
+## Description:
+## Detection of the language of captions, so that non-English posts can be filtered out before classification (5a) and sentiment analysis (5b).
+## Language detection uses langdetect (the same detection used by spacy_langdetect), run as a component of a tokenizer-only spaCy pipeline and processed in batches through nlp.pipe (optionally across processes).
+## Unlike spacy_langdetect, which detects the language only when doc._.language is read, the component detects the language when the doc is processed, so the work is done within the worker processes.
+## A cheap prefilter runs before: captions without any letters are given "und" (undetermined) and captions written only in non-Latin scripts are given "xx" (non-English, spaCy's code for multi-language), without running langdetect.
+## Results are returned as a language code and confidence (score) column for each post.
+
+import numpy as np
+import pandas as pd
+from spacy.language import Language
+from spacy.tokens import Doc
+
+## Columns added by detect_languages
+LANGUAGE_COLUMNS = ['language', 'language_score']
+
+if not Doc.has_extension("lang_detect"):
+  Doc.set_extension("lang_detect", default=None)
+
+def _detect(text):
+  from langdetect import DetectorFactory, detect_langs
+  from langdetect.lang_detect_exception import LangDetectException
+  # langdetect is random by default, set the seed so that results are the same every run
+  DetectorFactory.seed = 0
+  try:
+    detected_language = detect_langs(text)[0]
+    return (str(detected_language.lang), float(detected_language.prob))
+  except LangDetectException:
+    return ("und", 0.0)
+
+class LanguageDetectorComponent:
+  def __call__(self, doc):
+    doc._.lang_detect = _detect(doc.text)
+    return doc
+
+@Language.factory("twitter_language_detector")
+def create_twitter_language_detector(nlp, name):
+  return LanguageDetectorComponent()
+
+def make_language_nlp():
+  ## Tokenizer-only pipeline (multi-language tokenizer) with the language detector
+  import spacy
+  nlp = spacy.blank("xx")
+  nlp.add_pipe("twitter_language_detector")
+  return nlp
+
+def prefilter_languages(texts):
+  ## Language codes from the cheap prefilter ("und" or "xx"), None for captions that need langdetect
+  texts = pd.Series(texts).reset_index(drop=True)
+  is_text = texts.map(lambda text: isinstance(text, str))
+  as_text = texts.where(is_text, '').astype(str)
+  n_letters = as_text.str.count(r'[^\W\d_]')
+  n_latin = as_text.str.count(r'[A-Za-zÀ-ɏ]')
+  language = pd.Series(None, index=texts.index, dtype=object)
+  language[n_letters == 0] = "und"
+  language[(n_letters > 0) & (n_latin == 0)] = "xx"
+  return language
+
+def detect_languages(texts, nlp=None, batch_size=1000, n_process=1):
+  ## DataFrame with the language code and confidence (language_score) of each caption, in input order
+  if nlp is None:
+    nlp = make_language_nlp()
+  texts = pd.Series(texts).reset_index(drop=True)
+  language = prefilter_languages(texts)
+  score = np.where(language == "xx", 1.0, 0.0)
+  rows = np.flatnonzero(language.isna().to_numpy())
+  docs = nlp.pipe(texts.iloc[rows].tolist(), batch_size=batch_size, n_process=n_process)
+  detected = [doc._.lang_detect for doc in docs]
+  if detected:
+    language.iloc[rows] = [lang for lang, _ in detected]
+    score[rows] = [prob for _, prob in detected]
+  return pd.DataFrame({'language': language.to_numpy(), 'language_score': score})
+
+def add_languages(posts, text_col, **kwargs):
+  ## Copy of posts (with a fresh index) with the language and language_score columns of the captions in text_col
+  posts = posts.reset_index(drop=True)
+  languages = detect_languages(posts[text_col], **kwargs)
+  for column in LANGUAGE_COLUMNS:
+    posts[column] = languages[column].values
+  return posts
+
+def is_english(posts, min_score=0.0):
+  ## Boolean mask of the posts detected as English (with a language_score of at least min_score)
+  return (posts['language'] == 'en') & (posts['language_score'] >= min_score)
@@ -0,0 +1,48 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - reading the CSV files
+
+## Description:
+## Reading of the Twitter CSV files (5_1_Twiiter.csv, 5_2_Twiiter_Insects.csv, the train/test data and the evaluation data) with only the columns a step needs.
+## Category columns (e.g. category, Category, pred_cat) are read as pandas Categorical with the nine CATEGORIES (in that order) as categories, which stores one small integer per post instead of a string.
+## Values that are not one of the nine categories are kept as extra categories after them. With codes=True, the int8 codes of evaluation.py (position in CATEGORIES, len(CATEGORIES) for other values and NaN) are returned instead.
+## iter_posts reads a file chunk by chunk, so that files larger than memory can be streamed through a step.
+
+import numpy as np
+import pandas as pd
+
+from .categories import CATEGORIES
+
+CATEGORY_COLUMNS = ['category', 'Category', 'pred_cat']
+
+def _as_categories(values, codes=False):
+  values = values.astype('category')
+  unknown = sorted(set(values.cat.categories) - set(CATEGORIES))
+  values = values.cat.set_categories(CATEGORIES + unknown)
+  if not codes:
+    return values
+  category_codes = values.cat.codes.to_numpy().astype(np.int8)
+  category_codes[(category_codes < 0) | (category_codes >= len(CATEGORIES))] = len(CATEGORIES)
+  return pd.Series(category_codes, index=values.index, name=values.name)
+
+def _prepare(frame, category_columns, codes):
+  for column in category_columns:
+    if column in frame:
+      frame[column] = _as_categories(frame[column], codes)
+  return frame
+
+def read_posts(path, columns=None, category_columns=CATEGORY_COLUMNS, codes=False, **kwargs):
+  ## Read the columns of a CSV file (all columns if columns is None). Columns in category_columns are returned as Categorical (or int8 codes with codes=True).
+  ## Other arguments are passed to pd.read_csv.
+  frame = pd.read_csv(path, usecols=columns, **kwargs)
+  return _prepare(frame, category_columns, codes)
+
+def iter_posts(path, columns=None, chunk_size=100_000, category_columns=CATEGORY_COLUMNS, codes=False, **kwargs):
+  ## Yield the columns of a CSV file in DataFrames of up to chunk_size rows. The index continues across chunks (row number within the file).
+  ## Category columns have the same categories in every chunk (unless a chunk has values outside the nine categories), so chunks can be concatenated.
+  with pd.read_csv(path, usecols=columns, chunksize=chunk_size, **kwargs) as reader:
+    for chunk in reader:
+      yield _prepare(chunk, category_columns, codes)
+
+def memory_mb(frame):
+  ## Memory used by a DataFrame, including the strings of text columns, in MB
+  return frame.memory_usage(deep=True).sum() / 2 ** 20
@@ -0,0 +1,74 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - VADER sentiment scores
+
+## Description:
+## VADER sentiment scores of raw captions (5b). VADER is run on raw captions as punctuations and word shape (e.g. caps) are used to determine sentiments.
+## Sentiments are assigned based on the compound score: positive >= 0.05, -0.05 > neutral > 0.05, negative <= -0.05.
+## Captions that are NaN are given NaN scores and no sentiment.
+## With n_process > 1, the captions are split into chunks that are scored across a process pool, with one SentimentIntensityAnalyzer in each worker process.
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .cache import score_unique
+
+## Columns of the scores array, in order
+SCORE_COLUMNS = ['pos', 'neu', 'neg', 'compound']
+
+## Analyser of each worker process, created once by _init_worker
+_worker_analyser = None
+
+def _init_worker():
+  global _worker_analyser
+  from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+  _worker_analyser = SentimentIntensityAnalyzer()
+
+def _score_chunk(captions, analyser=None):
+  analyser = analyser or _worker_analyser
+  scores = np.empty((len(captions), len(SCORE_COLUMNS)))
+  for i, caption in enumerate(captions):
+    caption_score = analyser.polarity_scores(caption)
+    scores[i] = [caption_score[column] for column in SCORE_COLUMNS]
+  return scores
+
+def _iter_scores(captions, analyser=None, n_process=1, chunk_size=10000):
+  ## Yield the scores of a list of captions in chunks of chunk_size, scored serially or across a process pool
+  chunks = [captions[s:s + chunk_size] for s in range(0, len(captions), chunk_size)]
+  if n_process <= 1 or len(chunks) <= 1:
+    if analyser is None:
+      from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+      analyser = SentimentIntensityAnalyzer()
+    for chunk in chunks:
+      yield _score_chunk(chunk, analyser)
+    return
+  with ProcessPoolExecutor(max_workers=n_process, initializer=_init_worker) as pool:
+    yield from pool.map(_score_chunk, chunks)
+
+def score_captions(captions, analyser=None, cache=None, n_process=1, chunk_size=10000, monitor=None):
+  ## N x 4 float64 array of the pos, neu, neg and compound scores. Identical captions are only scored once, and with a PredictionCache (see cache.py) captions scored before are taken from the cache.
+  ## With a StageMonitor (see instrument.py), progress is reported after every chunk.
+  return score_unique(captions, lambda unique_captions: _iter_scores(unique_captions, analyser, n_process, chunk_size), len(SCORE_COLUMNS), np.float64, cache, monitor)
+
+def label_sentiments(compound):
+  ## 'pos', 'neg' or 'neu' from the compound scores, in one vectorized operation (NaN for NaN scores)
+  compound = np.asarray(compound, dtype=float)
+  labels = np.where(compound >= 0.05, 'pos', np.where(compound <= -0.05, 'neg', 'neu')).astype(object)
+  labels[np.isnan(compound)] = np.nan
+  return labels
+
+def sentiment_frame(captions, **kwargs):
+  ## DataFrame with the same sentiment columns as 5b (caption_sentiment_new, caption_compound_score, caption_pos_score, caption_neu_score, caption_neg_score)
+  return sentiment_columns(score_captions(captions, **kwargs))
+
+def sentiment_columns(scores):
+  ## DataFrame of the sentiment columns of 5b from an N x 4 array of scores
+  pos, neu, neg, compound = np.asarray(scores, dtype=float).T
+  return pd.DataFrame({
+    'caption_sentiment_new': label_sentiments(compound),
+    'caption_compound_score': compound,
+    'caption_pos_score': pos,
+    'caption_neu_score': neu,
+    'caption_neg_score': neg,
+  })
@@ -0,0 +1,237 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - local classification service
+
+## Description:
+## Small local HTTP service that loads the trained spaCy classifier (or another classifier backend, see backends.py) once and classifies captions sent to it, e.g. by dashboards classifying incoming posts.
+## Concurrent requests are gathered into micro-batches (up to --max-batch-size captions, waiting at most --max-wait-ms for more to arrive) that are run through the model together.
+## The probabilities and the category with the highest probability are computed as in Step 6 of 5a (see classify.py); captions that are null are assigned as "Others".
+## Only the Python standard library (asyncio) is used for the server.
+## Usage (from the Scripts folder): python -m twitter_pipeline.service --model ..//data//spacy_model//model-best --port 8050
+## POST /classify with {"text": "..."} or {"texts": ["...", ...]} (cleaned captions, as in the Cleaned_Caption column)
+##   returns {"category": ..., "probabilities": {...}} or {"results": [...]}
+## GET /metrics returns the number of requests, captions and batches, the mean batch size, latencies (ms) and throughput (captions/sec)
+## GET /health returns {"status": "ok"}
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .categories import CATEGORIES
+from .classify import classify_texts
+
+class ServiceMetrics:
+  ## Counts of requests, captions and batches, and the latencies of the most recent requests
+  def __init__(self, window=10000):
+    self.started = time.monotonic()
+    self.n_requests = 0
+    self.n_texts = 0
+    self.n_batches = 0
+    self.n_errors = 0
+    self.latencies = deque(maxlen=window)
+    self.batch_seconds = 0.0
+
+  def add_batch(self, n_texts, seconds):
+    self.n_batches += 1
+    self.n_texts += n_texts
+    self.batch_seconds += seconds
+
+  def add_request(self, seconds):
+    self.n_requests += 1
+    self.latencies.append(seconds)
+
+  def report(self):
+    uptime = time.monotonic() - self.started
+    report = {"uptime_s": round(uptime, 3), "requests": self.n_requests, "errors": self.n_errors,
+              "texts": self.n_texts, "batches": self.n_batches,
+              "mean_batch_size": round(self.n_texts / self.n_batches, 2) if self.n_batches else None,
+              "texts_per_s": round(self.n_texts / uptime, 2) if uptime else None,
+              "model_texts_per_s": round(self.n_texts / self.batch_seconds, 2) if self.batch_seconds else None}
+    if self.latencies:
+      p50, p95, p99 = np.percentile(np.array(self.latencies) * 1000, [50, 95, 99])
+      report.update({"latency_ms_p50": round(p50, 3), "latency_ms_p95": round(p95, 3), "latency_ms_p99": round(p99, 3),
+                     "latency_ms_max": round(max(self.latencies) * 1000, 3)})
+    return report
+
+class MicroBatcher:
+  ## Gathers captions from concurrent callers of classify() into batches for the model.
+  ## The model runs in a single worker thread, so the event loop keeps accepting requests (which form the next batch) while a batch is being classified.
+  def __init__(self, nlp, max_batch_size=64, max_wait_ms=5.0, metrics=None):
+    self.nlp = nlp
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait_ms / 1000
+    self.metrics = ServiceMetrics() if metrics is None else metrics
+    self._queue = None
+    self._task = None
+    self._executor = ThreadPoolExecutor(max_workers=1)
+
+  async def start(self):
+    self._queue = asyncio.Queue()
+    self._task = asyncio.create_task(self._run())
+
+  async def stop(self):
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+    self._executor.shutdown(wait=True)
+
+  async def classify(self, texts):
+    ## Returns a list of (category, probabilities) for the captions, in order. Probabilities are None for captions that are null.
+    future = asyncio.get_running_loop().create_future()
+    await self._queue.put((list(texts), future))
+    return await future
+
+  async def _run(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      pending = [await self._queue.get()]
+      n_texts = len(pending[0][0])
+      deadline = loop.time() + self.max_wait
+      while n_texts < self.max_batch_size:
+        timeout = deadline - loop.time()
+        try:
+          item = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self._queue.get(), timeout)
+        except (asyncio.QueueEmpty, asyncio.TimeoutError):
+          break
+        pending.append(item)
+        n_texts += len(item[0])
+      texts = [text for item, _ in pending for text in item]
+      start = time.perf_counter()
+      try:
+        results = await loop.run_in_executor(self._executor, self._classify_batch, texts)
+      except Exception as error:
+        self.metrics.n_errors += len(pending)
+        for _, future in pending:
+          if not future.done():
+            future.set_exception(error)
+        continue
+      self.metrics.add_batch(len(texts), time.perf_counter() - start)
+      k = 0
+      for item, future in pending:
+        if not future.done():
+          future.set_result(results[k:k + len(item)])
+        k += len(item)
+
+  def _classify_batch(self, texts):
+    # Null captions are passed on as NaN, which classify_texts assigns as "Others"
+    texts = [np.nan if text is None else text for text in texts]
+    probs, pred_cat = classify_texts(self.nlp, texts, batch_size=self.max_batch_size)
+    return [(category, None if np.isnan(row).all() else dict(zip(CATEGORIES, row.tolist())))
+            for category, row in zip(pred_cat, probs)]
+
+def _result(category, probabilities):
+  return {"category": category, "probabilities": probabilities}
+
+class ClassificationService:
+  ## HTTP/1.1 front end of a MicroBatcher (keep-alive, JSON bodies)
+  def __init__(self, batcher, host="127.0.0.1", port=8050):
+    self.batcher = batcher
+    self.host = host
+    self.port = port
+    self.server = None
+
+  async def start(self):
+    await self.batcher.start()
+    self.server = await asyncio.start_server(self._handle, self.host, self.port)
+    self.port = self.server.sockets[0].getsockname()[1]
+    return self
+
+  async def stop(self):
+    if self.server is not None:
+      self.server.close()
+      await self.server.wait_closed()
+    await self.batcher.stop()
+
+  async def serve_forever(self):
+    async with self.server:
+      await self.server.serve_forever()
+
+  async def _handle(self, reader, writer):
+    try:
+      while True:
+        request_line = await reader.readline()
+        if not request_line:
+          break
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+          line = await reader.readline()
+          if line in (b'\r\n', b'\n', b''):
+            break
+          name, _, value = line.decode('latin-1').partition(':')
+          headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        status, payload = await self._route(method, path.split('?')[0], body)
+        data = json.dumps(payload).encode()
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+        await writer.drain()
+        if not keep_alive:
+          break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+      pass
+    finally:
+      writer.close()
+
+  async def _route(self, method, path, body):
+    if method == 'GET' and path == '/health':
+      return "200 OK", {"status": "ok"}
+    if method == 'GET' and path == '/metrics':
+      return "200 OK", self.batcher.metrics.report()
+    if method == 'POST' and path == '/classify':
+      start = time.perf_counter()
+      try:
+        request = json.loads(body or b'{}')
+        single = 'text' in request
+        texts = [request['text']] if single else request['texts']
+        if not isinstance(texts, list) or not all(text is None or isinstance(text, str) for text in texts):
+          raise ValueError
+      except (ValueError, KeyError, TypeError):
+        self.batcher.metrics.n_errors += 1
+        return "400 Bad Request", {"error": 'Expected {"text": "..."} or {"texts": ["...", ...]}'}
+      try:
+        results = await self.batcher.classify(texts)
+      except Exception as error:
+        return "500 Internal Server Error", {"error": str(error)}
+      self.batcher.metrics.add_request(time.perf_counter() - start)
+      if single:
+        return "200 OK", _result(*results[0])
+      return "200 OK", {"results": [_result(*result) for result in results]}
+    return "404 Not Found", {"error": f"No route for {method} {path}"}
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Serve the trained spaCy classifier over HTTP with micro-batching.")
+  parser.add_argument('--model', default="data//spacy_model//model-best", help="spaCy model or hashed model folder (see backends.py)")
+  parser.add_argument('--host', default="127.0.0.1")
+  parser.add_argument('--port', type=int, default=8050)
+  parser.add_argument('--max-batch-size', type=int, default=64, help="Largest number of captions per model batch")
+  parser.add_argument('--max-wait-ms', type=float, default=5.0, help="Longest time a request waits for others to join its batch")
+  args = parser.parse_args(argv)
+  from .backends import load_backend
+  nlp = load_backend(args.model)
+
+  async def serve():
+    service = await ClassificationService(MicroBatcher(nlp, args.max_batch_size, args.max_wait_ms), args.host, args.port).start()
+    print(f"Classifying on http://{service.host}:{service.port}/classify (batches of up to {args.max_batch_size}, waiting up to {args.max_wait_ms} ms)")
+    try:
+      await service.serve_forever()
+    finally:
+      await service.stop()
+
+  try:
+    asyncio.run(serve())
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
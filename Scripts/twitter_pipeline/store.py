@@ -0,0 +1,105 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - prediction store
+
+## Description:
+## Storage of classifier outputs as NumPy arrays instead of stringified dicts in CSV files.
+## A prediction store is a folder with one .npy file per column:
+## - probs.npy: N x 9 float32 probabilities, columns in CATEGORIES order (NaN for captions that were not classified)
+## - pred_code.npy / label_code.npy: int8 codes of the predicted and the manually assigned categories (position in CATEGORIES)
+## - post_id.npy: ID of each post
+## - meta.json: category order, number of rows and the columns that were saved
+## The .npy files are opened memory-mapped, so only the requested columns and rows are read from disk.
+## Note that probabilities are saved as float32; a probability that is (almost) exactly on a threshold may be rounded to the other side of it compared to the pred_dict strings.
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .categories import CATEGORIES, CATEGORY_CODES
+from .evaluation import encode_categories, decode_categories
+from .thresholds import parse_pred_dicts
+
+STORE_COLUMNS = ['post_id', 'probs', 'pred_code', 'label_code']
+
+def _save_array(path, array):
+  # Write to a temporary file first, so that an interrupted write does not replace a complete file
+  tmp_path = path.with_name(path.stem + ".tmp.npy")
+  np.save(tmp_path, array, allow_pickle=False)
+  os.replace(tmp_path, path)
+
+def write_predictions(path, probs, post_id, pred_cat=None, true_cat=None):
+  ## Save the probabilities and post IDs (and optionally the predicted categories and manually assigned categories) as a prediction store at path.
+  ## post_id is required so that the store can always be joined back to the posts (row numbers change once posts are filtered). pred_cat defaults to the category with the highest probability.
+  path = Path(path)
+  path.mkdir(parents=True, exist_ok=True)
+  probs = np.asarray(probs, dtype=np.float32)
+  if probs.ndim != 2 or probs.shape[1] != len(CATEGORIES):
+    raise ValueError(f"probs must have shape (N, {len(CATEGORIES)}), got {probs.shape}")
+  n_rows = len(probs)
+  if pred_cat is None:
+    has_probs = ~np.isnan(probs).all(axis=1)
+    pred_code = np.full(n_rows, CATEGORY_CODES["Others"], dtype=np.int8)
+    pred_code[has_probs] = np.nanargmax(probs[has_probs], axis=1)
+  else:
+    pred_code = encode_categories(pred_cat)
+  post_id = np.asarray(post_id)
+  if post_id.dtype == object:
+    post_id = post_id.astype(str)
+  columns = {'post_id': post_id, 'probs': probs, 'pred_code': pred_code}
+  if true_cat is not None:
+    columns['label_code'] = encode_categories(true_cat)
+  for column, array in columns.items():
+    if len(array) != n_rows:
+      raise ValueError(f"{column} has {len(array)} rows, expected {n_rows}")
+    _save_array(path / f"{column}.npy", array)
+  with open(path / "meta.json", "w") as f:
+    json.dump({"categories": CATEGORIES, "n_rows": n_rows, "columns": list(columns)}, f)
+
+def read_meta(path):
+  with open(Path(path) / "meta.json") as f:
+    meta = json.load(f)
+  if meta["categories"] != CATEGORIES:
+    raise ValueError(f"{path} was saved with a different category order: {meta['categories']}")
+  return meta
+
+def read_arrays(path, columns=None, rows=None):
+  ## Dict of the requested columns (default: all saved columns) as arrays. rows is an optional slice or array of row numbers.
+  ## Without rows, memory-mapped (read-only) arrays are returned and nothing is read from disk until the values are used.
+  meta = read_meta(path)
+  columns = meta["columns"] if columns is None else list(columns)
+  arrays = {}
+  for column in columns:
+    if column not in meta["columns"]:
+      raise KeyError(f"{column} is not saved in {path} (saved columns: {meta['columns']})")
+    array = np.load(Path(path) / f"{column}.npy", mmap_mode='r')
+    arrays[column] = array if rows is None else np.asarray(array[rows])
+  return arrays
+
+def read_probs(path, rows=None):
+  ## N x 9 probabilities, e.g. for threshold_sweep(read_probs(path), ...)
+  return read_arrays(path, ['probs'], rows)['probs']
+
+def read_predictions(path, columns=None, rows=None):
+  ## The requested columns as a DataFrame: probabilities as one column per category, and codes decoded back to category names ("pred_cat", "category")
+  arrays = read_arrays(path, columns, rows)
+  n_rows = len(next(iter(arrays.values()))) if arrays else 0
+  predictions = pd.DataFrame(index=pd.RangeIndex(n_rows))
+  if 'post_id' in arrays:
+    predictions['post_id'] = arrays['post_id']
+  if 'label_code' in arrays:
+    predictions['category'] = decode_categories(arrays['label_code'])
+  if 'pred_code' in arrays:
+    predictions['pred_cat'] = decode_categories(arrays['pred_code'])
+  if 'probs' in arrays:
+    for code, category in enumerate(CATEGORIES):
+      predictions[category] = arrays['probs'][:, code]
+  return predictions
+
+def convert_eval_csv(csv_path, path):
+  ## Convert an evaluation CSV with a pred_dict column (e.g. "test_spaCy_twitter_eval.csv") into a prediction store
+  ## The evaluation CSV has no post IDs, so its row numbers are saved as post_id
+  eval_data = pd.read_csv(csv_path, usecols=lambda column: column in ['pred_dict', 'pred_cat', 'category'])
+  write_predictions(path, parse_pred_dicts(eval_data['pred_dict']), np.arange(len(eval_data), dtype=np.int64), pred_cat=eval_data.get('pred_cat'), true_cat=eval_data.get('category'))
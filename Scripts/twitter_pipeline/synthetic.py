@@ -0,0 +1,89 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - synthetic #conservation posts
+
+## Description:
+## Seeded generator of #conservation-style captions, categories and pred_dict probabilities, used for benchmarking the pipeline without the Zenodo data.
+## Captions mix taxon words of their category with general conservation words, stopwords, hashtags, mentions, links, numbers and emojis. 
+## A share of the posts are retweets (i.e. "RT @user: " followed by the caption of an earlier post) and a few captions are missing (NaN), as in the real data.
+## The same n and seed always give the same posts.
+
+import numpy as np
+import pandas as pd
+
+from .categories import CATEGORIES
+
+## Words that are typical of each category
+TAXON_WORDS = {
+  "Insects": ["bee", "bees", "butterfly", "moth", "beetle", "dragonfly", "ant", "pollinator", "firefly", "insect"],
+  "Plants": ["tree", "forest", "mangrove", "orchid", "seedling", "rainforest", "plant", "flora", "peatland", "reforestation"],
+  "Other Invertebrate Groups": ["coral", "reef", "crab", "spider", "snail", "jellyfish", "shrimp", "octopus", "starfish", "clam"],
+  "Birds": ["bird", "hornbill", "eagle", "owl", "parrot", "migratory", "nest", "birding", "raptor", "heron"],
+  "Fish": ["shark", "fish", "manta", "tuna", "fishing", "fisheries", "seahorse", "bycatch", "salmon", "ray"],
+  "Amphibians & Reptiles": ["turtle", "frog", "crocodile", "snake", "lizard", "tortoise", "gecko", "python", "monitor", "amphibian"],
+  "Mammals": ["elephant", "tiger", "orangutan", "pangolin", "rhino", "leopard", "dolphin", "whale", "gibbon", "bear"],
+  "Undefined Groups": ["wildlife", "species", "biodiversity", "animals", "endangered", "habitat", "extinction", "ecosystem", "nature", "poaching"],
+  "Others": ["climate", "plastic", "ocean", "policy", "community", "volunteer", "donate", "event", "webinar", "sustainability"],
+}
+
+## Share of each category among the posts
+CATEGORY_WEIGHTS = [0.04, 0.12, 0.05, 0.08, 0.06, 0.06, 0.17, 0.14, 0.28]
+
+GENERAL_WORDS = ["conservation", "protect", "help", "today", "new", "project", "local", "support", "world", "future", "team", "research", "rescue", "park", "save"]
+STOPWORDS = ["the", "and", "of", "to", "a", "in", "is", "for", "our", "we", "this", "with", "on", "are", "it"]
+EXTRAS = ["#conservation", "#wildlife", "#nature", "#climatechange", "@WWF", "@TheNatureConservancy", "https://t.co/abc123", "2023", "!!", "🐝", "🌿", "🐢", "..."]
+
+def _make_captions(category_codes, rng):
+  ## Captions of one chunk of posts. Every word is a taxon word of the category of the post with probability 0.25, otherwise a general word, stopword or extra.
+  vocab = np.asarray([word for category in CATEGORIES for word in TAXON_WORDS[category]] + GENERAL_WORDS + STOPWORDS + EXTRAS, dtype=object)
+  n_taxon_words = len(TAXON_WORDS[CATEGORIES[0]])
+  n_other_words = len(GENERAL_WORDS + STOPWORDS + EXTRAS)
+  n_words = rng.integers(5, 40, size=len(category_codes))
+  ends = np.cumsum(n_words)
+  starts = ends - n_words
+  token_post = np.repeat(np.arange(len(category_codes)), n_words)
+  is_taxon = rng.random(len(token_post)) < 0.25
+  token_ids = np.where(
+    is_taxon,
+    category_codes[token_post] * n_taxon_words + rng.integers(0, n_taxon_words, len(token_post)),
+    len(CATEGORIES) * n_taxon_words + rng.integers(0, n_other_words, len(token_post)))
+  words = vocab[token_ids]
+  return np.array([' '.join(words[start:end]) for start, end in zip(starts, ends)], dtype=object)
+
+def make_posts(n, seed=1234, nan_rate=0.002, retweet_rate=0.3, chunk_size=200_000):
+  ## DataFrame of n synthetic posts with the columns post_id, Raw_Caption and category
+  rng = np.random.default_rng(seed)
+  category_codes = rng.choice(len(CATEGORIES), size=n, p=CATEGORY_WEIGHTS)
+  captions = np.empty(n, dtype=object)
+  for start in range(0, n, chunk_size):
+    captions[start:start + chunk_size] = _make_captions(category_codes[start:start + chunk_size], rng)
+  # Retweets copy the caption (and category) of an earlier post
+  is_retweet = rng.random(n) < retweet_rate
+  if n:
+    is_retweet[0] = False
+  retweet_rows = np.flatnonzero(is_retweet)
+  source_rows = (rng.random(len(retweet_rows)) * retweet_rows).astype(np.int64)
+  category_codes[retweet_rows] = category_codes[source_rows]
+  captions[retweet_rows] = ["RT @user: " + caption for caption in captions[source_rows]]
+  captions[rng.random(n) < nan_rate] = np.nan
+  return pd.DataFrame({
+    'post_id': np.arange(n, dtype=np.int64),
+    'Raw_Caption': captions,
+    'category': np.asarray(CATEGORIES, dtype=object)[category_codes],
+  })
+
+def make_probs(categories, seed=1234, accuracy=0.8):
+  ## N x 9 array of classifier-like probabilities: with probability accuracy, most of the weight is on the given category, otherwise on a random one
+  rng = np.random.default_rng(seed)
+  codes = pd.Categorical(categories, categories=CATEGORIES).codes
+  codes = np.where(codes < 0, len(CATEGORIES) - 1, codes)
+  correct = rng.random(len(codes)) < accuracy
+  peak = np.where(correct, codes, rng.integers(0, len(CATEGORIES), len(codes)))
+  alpha = np.full((len(codes), len(CATEGORIES)), 0.3)
+  alpha[np.arange(len(codes)), peak] = 5.0
+  # Dirichlet draws through normalized gamma draws
+  probs = rng.gamma(alpha)
+  return probs / probs.sum(axis=1, keepdims=True)
+
+def make_pred_dicts(probs):
+  ## pred_dict strings in the format of "test_spaCy_twitter_eval.csv"
+  return pd.Series([str(dict(zip(CATEGORIES, map(float, row)))) for row in probs])
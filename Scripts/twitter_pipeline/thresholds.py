@@ -0,0 +1,126 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - threshold analysis
+
+## Description:
+## Evaluation of probability thresholds as an alternative to the "maximum" method of assigning categories (Step 5 of 5a).
+## For each threshold: if more than 1 category is above the threshold, the text is assigned as "Undefined Groups"; if none of the categories is above the threshold, it is assigned as "Others".
+## The pred_dict column is decoded only once into an N x 9 array of probabilities, after which any number of thresholds is evaluated at once.
+## Also produces the ROC curve (true positive rate against false positive rate) of each category and its area under the curve (AUC).
+
+import ast
+
+import numpy as np
+import pandas as pd
+
+from .categories import CATEGORIES, CATEGORY_CODES
+from .evaluation import encode_categories, counts_from_matrix, metrics_from_counts
+
+UNDEFINED = CATEGORY_CODES["Undefined Groups"]
+OTHERS = CATEGORY_CODES["Others"]
+
+def parse_pred_dicts(pred_dict):
+  ## Decode the pred_dict column (strings of Python dicts) into an N x 9 float64 array with columns in CATEGORIES order.
+  ## Rows without probabilities (i.e. ['NA'] for NaN captions) are stored as NaN and are always assigned as "Others".
+  pred_dict = list(pred_dict)
+  probs = np.full((len(pred_dict), len(CATEGORIES)), np.nan)
+  for row, value in enumerate(pred_dict):
+    if isinstance(value, str):
+      value = ast.literal_eval(value)
+    if isinstance(value, dict):
+      probs[row] = [value[category] for category in CATEGORIES]
+  return probs
+
+def format_pred_dicts(probs):
+  ## Inverse of parse_pred_dicts: the pred_dict strings of "test_spaCy_twitter_eval.csv" for an N x 9 array of probabilities (['NA'] for NaN rows)
+  probs = np.asarray(probs, dtype=float)
+  has_probs = ~np.isnan(probs).all(axis=1)
+  return [str(dict(zip(CATEGORIES, row))) if has else "['NA']" for row, has in zip(probs.tolist(), has_probs)]
+
+def _top_two(probs):
+  ## Highest and second highest probability of each row, and the category code of the highest. NaN rows get -inf so that they are never above a threshold.
+  probs = np.where(np.isnan(probs), -np.inf, probs)
+  top = np.argmax(probs, axis=1)
+  ordered = np.sort(probs, axis=1)
+  return ordered[:, -1], ordered[:, -2], top
+
+def assign_threshold_codes(probs, thresholds):
+  ## N x T array of assigned category codes, one column per threshold (broadcasting the rule over all thresholds at once).
+  thresholds = np.asarray(thresholds, dtype=float)
+  first, second, top = _top_two(np.asarray(probs, dtype=float))
+  # A category is above the threshold when its probability is > threshold, so more than 1 category is above the threshold when the second highest probability is
+  codes = np.where(first[:, None] > thresholds[None, :], top[:, None], OTHERS)
+  codes = np.where(second[:, None] > thresholds[None, :], UNDEFINED, codes)
+  return codes.astype(np.int8)
+
+def threshold_confusion_matrices(probs, true_cat, thresholds):
+  ## T x 10 x 10 stack of confusion matrices, one per threshold, counted without building the N x T array of assignments.
+  ## As the threshold goes up, each text is assigned "Undefined Groups" (threshold < second highest probability), then its top category (until threshold >= highest probability), then "Others".
+  ## Each text therefore adds 1 to three ranges of thresholds, which are marked with +1/-1 at the start and end of each range and summed with np.cumsum.
+  thresholds = np.asarray(thresholds, dtype=float)
+  order = np.argsort(thresholds)
+  sorted_thresholds = thresholds[order]
+  n_thresholds = len(thresholds)
+  n = len(CATEGORIES) + 1
+  first, second, top = _top_two(np.asarray(probs, dtype=float))
+  true_codes = encode_categories(true_cat).astype(np.int64)
+  # Number of thresholds below each probability
+  i_second = np.searchsorted(sorted_thresholds, second, side='left')
+  i_first = np.searchsorted(sorted_thresholds, first, side='left')
+  starts = np.concatenate([np.zeros_like(i_second), i_second, i_first])
+  ends = np.concatenate([i_second, i_first, np.full_like(i_first, n_thresholds)])
+  cells = np.concatenate([true_codes * n + UNDEFINED, true_codes * n + top, true_codes * n + OTHERS])
+  size = (n_thresholds + 1) * n * n
+  diff = np.bincount(starts * n * n + cells, minlength=size) - np.bincount(ends * n * n + cells, minlength=size)
+  matrices = np.cumsum(diff.reshape(n_thresholds + 1, n, n), axis=0)[:-1]
+  # Return the matrices in the order of the thresholds that were given
+  out = np.empty_like(matrices)
+  out[order] = matrices
+  return out
+
+def threshold_sweep(probs, true_cat, thresholds=np.arange(10, 100, 5) / 100):
+  ## Returns (all_eval_metrics, summary_eval_metrics) with the same columns as "threshold_spaCy_all_eval_metrics_twitter.csv" and "threshold_spaCy_summary_eval_metrics_twitter.csv".
+  thresholds = np.asarray(thresholds, dtype=float)
+  TP, FP, TN, FN = counts_from_matrix(threshold_confusion_matrices(probs, true_cat, thresholds))
+  metrics = metrics_from_counts(TP, FP, TN, FN)
+  k = len(CATEGORIES)
+  all_eval_metrics = pd.DataFrame({
+    'threshold': np.repeat(thresholds, k),
+    'category': np.tile(CATEGORIES, len(thresholds)),
+    'TP': TP.ravel(), 'FP': FP.ravel(), 'TN': TN.ravel(), 'FN': FN.ravel(),
+    **{column: metrics[column].ravel() for column in ['accuracy', 'precision', 'recall', 'specificity', 'fpr']},
+  })
+  ## Average of the eval_metrics of all categories for each threshold
+  summary_eval_metrics = all_eval_metrics.groupby('threshold', as_index=False, sort=False).mean(numeric_only=True)
+  return all_eval_metrics, summary_eval_metrics
+
+def roc_curves(probs, true_cat, thresholds=np.linspace(0, 1, 1001)):
+  ## ROC curve of each category (one-vs-rest, scored by the probability of that category): one row per category and threshold with the tpr and fpr.
+  thresholds = np.asarray(thresholds, dtype=float)
+  probs = np.where(np.isnan(probs), -np.inf, np.asarray(probs, dtype=float))
+  true_codes = encode_categories(true_cat)
+  frames = []
+  for code, category in enumerate(CATEGORIES):
+    is_category = true_codes == code
+    positives = np.sort(probs[is_category, code])
+    negatives = np.sort(probs[~is_category, code])
+    # Number of probabilities above each threshold
+    tp = len(positives) - np.searchsorted(positives, thresholds, side='right')
+    fp = len(negatives) - np.searchsorted(negatives, thresholds, side='right')
+    frames.append(pd.DataFrame({
+      'category': category,
+      'threshold': thresholds,
+      'tpr': tp / len(positives) if len(positives) else np.zeros(len(thresholds)),
+      'fpr': fp / len(negatives) if len(negatives) else np.zeros(len(thresholds)),
+    }))
+  return pd.concat(frames, ignore_index=True)
+
+def roc_auc_scores(roc):
+  ## Area under each ROC curve (trapezoidal rule), with the curve closed at (0, 0) and (1, 1)
+  auc = {}
+  for category, curve in roc.groupby('category', sort=False):
+    fpr = np.concatenate([[0.0], curve['fpr'].to_numpy(), [1.0]])
+    tpr = np.concatenate([[0.0], curve['tpr'].to_numpy(), [1.0]])
+    order = np.lexsort((tpr, fpr))
+    fpr, tpr = fpr[order], tpr[order]
+    auc[category] = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+  return pd.DataFrame({'category': list(auc), 'auc': list(auc.values())})
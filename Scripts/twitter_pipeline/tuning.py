@@ -0,0 +1,186 @@
+####### Identifying the knowledge and capacity gaps in Southeast Asian insect conservation
+####### Twitter pipeline - cross-validation and hyperparameter search
+
+## Description:
+## k-fold cross-validation of the spaCy textcat training (Step 3 of 5a) over a grid of settings, to estimate how well each setting does on posts it was not trained on.
+## The labelled posts are split into k folds stratified by category (see docs.py). For every setting in the grid and every fold, a model is trained on the other folds and evaluated on the fold.
+## The fold x setting jobs run n_workers at a time, each in its own process limited to threads_per_job threads (OMP/BLAS), so that the jobs together fill the cores without oversubscribing them.
+## The grid is a dict of lists of values:
+##   "config": paths of config files, e.g. one per textcat architecture (spacy.TextCatBOW, spacy.TextCatEnsemble, ...), since the settings of each architecture differ
+##   any other key: a spaCy config override, e.g. "training.dropout": [0.1, 0.2], "training.optimizer.learn_rate": [0.001, 0.0001]
+## Each job is saved to out_dir//jobs//setting_<s>_fold_<k> (train.log, model-best and result.json). Each job has a fingerprint: a hash of the labelled posts, k, seed, the contents of its config file and its overrides.
+## Jobs with a result.json of the same fingerprint are not run again; after any change to the labelled data, folds, config file or setting, the job is run again.
+## The results are collected into out_dir//jobs.csv (one row per job) and out_dir//leaderboard.csv (mean and standard deviation across folds of each setting, best first).
+## The valid posts are classified with model-best and evaluated in the same way as Step 4 (see evaluation.py); the spaCy scores of model-best (cats_score, cats_macro_f, cats_macro_auc, ...) are also kept.
+
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from .docs import build_fold_corpora
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+def expand_grid(grid):
+  ## List of settings, one for each combination of values in grid, e.g. {"training.dropout": [0.1, 0.2]} gives [{"training.dropout": 0.1}, {"training.dropout": 0.2}]
+  keys = sorted(grid)
+  return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+def _job_environment(n_threads):
+  ## Environment of a job process: the thread limits of OpenMP and the BLAS libraries (read on start-up), and the Scripts folder on the path so the job can import twitter_pipeline
+  env = {**os.environ, **{name: str(n_threads) for name in THREAD_VARIABLES}}
+  env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(Path(__file__).resolve().parents[1]), os.environ.get('PYTHONPATH')]))
+  return env
+
+def data_digest(texts, categories):
+  ## Hash of the labelled posts (texts and categories, in order)
+  digest = hashlib.sha256()
+  for values in (texts, categories):
+    digest.update(pd.util.hash_pandas_object(pd.Series(values, dtype=object).reset_index(drop=True), index=False).to_numpy().tobytes())
+  return digest.hexdigest()
+
+def job_fingerprint(data_hash, k, seed, config, overrides):
+  ## Hash of everything that determines the result of a job: the labelled posts, the folds (k and seed), the contents of the config file and the overrides
+  with open(config, 'rb') as f:
+    config_hash = hashlib.sha256(f.read()).hexdigest()
+  key = json.dumps({"data": data_hash, "k": k, "seed": seed, "config": config_hash, "overrides": overrides}, sort_keys=True, default=str)
+  return hashlib.sha256(key.encode()).hexdigest()
+
+def _valid_posts(valid_dir):
+  ## Texts and categories (the category with cats = 1) of the docs in the DocBin shards of valid_dir
+  import spacy
+  from spacy.tokens import DocBin
+  vocab = spacy.blank("en").vocab
+  texts, categories = [], []
+  for shard in sorted(Path(valid_dir).glob("*.spacy")):
+    for doc in DocBin().from_disk(shard).get_docs(vocab):
+      texts.append(doc.text)
+      categories.append(max(doc.cats, key=doc.cats.get))
+  return texts, categories
+
+def _run_job(job):
+  ## Train one setting on one fold and evaluate model-best on the valid fold (runs in the job process, see _start_job)
+  import spacy
+  from spacy.cli.train import train
+  from .classify import classify_texts
+  from .evaluation import average_metrics, evaluate_predictions
+  job_dir = Path(job['job_dir'])
+  job_dir.mkdir(parents=True, exist_ok=True)
+  fold_dir = Path(job['fold_dir'])
+  overrides = {"paths.train": str(fold_dir / "train"), "paths.dev": str(fold_dir / "valid"), **job['overrides']}
+  start = time.perf_counter()
+  train(config_path=Path(job['config']), output_path=job_dir, overrides=overrides)
+  train_seconds = time.perf_counter() - start
+  model_path = job_dir / "model-best"
+  with open(model_path / "meta.json") as f:
+    performance = json.load(f).get("performance", {})
+  texts, categories = _valid_posts(fold_dir / "valid")
+  _, pred_cat = classify_texts(spacy.load(model_path), texts)
+  averages = average_metrics(evaluate_predictions(categories, pred_cat)).set_index('category')
+  result = {
+    "setting": job['setting'], "fold": job['fold'], "config": job['config'], "overrides": json.dumps(job['overrides'], sort_keys=True), "fingerprint": job['fingerprint'],
+    "train_seconds": train_seconds, "n_valid": len(texts),
+    **{f"spacy_{name}": value for name, value in performance.items() if isinstance(value, (int, float))},
+    **{f"{average}_{metric}": float(averages.loc[average, metric]) for average in ['macro', 'micro'] for metric in ['accuracy', 'precision', 'recall', 'specificity']},
+  }
+  with open(job_dir / "result.json", "w") as f:
+    json.dump(result, f, indent=2)
+  return result
+
+def _start_job(job, threads_per_job):
+  ## Run a job in a new Python process with its own thread limits. The output of spaCy training goes to the train.log of the job, so that the output of parallel jobs is not mixed up.
+  job_dir = Path(job['job_dir'])
+  job_dir.mkdir(parents=True, exist_ok=True)
+  # Remove the result of an earlier run of the job, so that a failed run does not leave an old result behind
+  (job_dir / "result.json").unlink(missing_ok=True)
+  with open(job_dir / "job.json", "w") as f:
+    json.dump(job, f, indent=2)
+  with open(job_dir / "train.log", "w") as log:
+    completed = subprocess.run([sys.executable, "-m", "twitter_pipeline.tuning", str(job_dir / "job.json")], env=_job_environment(threads_per_job), stdout=log, stderr=subprocess.STDOUT)
+  if completed.returncode != 0:
+    raise RuntimeError(f"Job {job_dir} failed, see {job_dir / 'train.log'}")
+  with open(job_dir / "result.json") as f:
+    return json.load(f)
+
+def leaderboard(results, sort_by="spacy_cats_score"):
+  ## Mean and standard deviation across folds of the metrics of each setting, sorted by the mean of sort_by (best first)
+  results = pd.DataFrame(results)
+  metric_columns = [c for c in results.columns if c not in ['setting', 'fold', 'config', 'overrides', 'fingerprint'] and pd.api.types.is_numeric_dtype(results[c])]
+  grouped = results.groupby(['setting', 'config', 'overrides'])
+  board = grouped[metric_columns].agg(['mean', 'std'])
+  board.columns = [f"{metric}_{stat}" for metric, stat in board.columns]
+  board.insert(0, "n_folds", grouped.size())
+  board = board.reset_index()
+  sort_column = f"{sort_by}_mean"
+  if sort_column in board:
+    board = board.sort_values(sort_column, ascending=False, kind='stable')
+  return board.reset_index(drop=True)
+
+def run_search(texts, categories, config_path, grid, out_dir, k=5, seed=1234, n_workers=None, threads_per_job=1, shard_size=10000, sort_by="spacy_cats_score", monitor=None):
+  ## Cross-validate every setting of grid (see expand_grid) on k folds of the labelled posts. Returns (leaderboard, results), which are also saved to out_dir.
+  ## config_path is the config file for settings without a "config" key. n_workers defaults to the number of cores divided by threads_per_job.
+  ## With a StageMonitor (see instrument.py), progress is reported in finished jobs.
+  out_dir = Path(out_dir)
+  fold_dirs = build_fold_corpora(texts, categories, out_dir / "folds", k=k, seed=seed, shard_size=shard_size)
+  data_hash = data_digest(texts, categories)
+  settings = expand_grid(grid) if grid else [{}]
+  jobs = []
+  for s, setting in enumerate(settings):
+    overrides = {key: value for key, value in setting.items() if key != 'config'}
+    config = str(setting.get('config', config_path))
+    fingerprint = job_fingerprint(data_hash, k, seed, config, overrides)
+    for fold, fold_dir in enumerate(fold_dirs):
+      jobs.append({"setting": s, "fold": fold, "config": config, "overrides": overrides, "fingerprint": fingerprint, "fold_dir": str(fold_dir),
+                   "job_dir": str(out_dir / "jobs" / f"setting_{s:03d}_fold_{fold}")})
+  with open(out_dir / "settings.json", "w") as f:
+    json.dump([{"setting": s, **setting} for s, setting in enumerate(settings)], f, indent=2, default=str)
+
+  results = []
+  todo = []
+  for job in jobs:
+    result_path = Path(job['job_dir']) / "result.json"
+    if result_path.exists():
+      with open(result_path) as f:
+        result = json.load(f)
+      # Only reuse results of the same labelled posts, folds, config file contents and setting (any of them may have changed since the earlier run)
+      if result.get('fingerprint') == job['fingerprint']:
+        results.append(result)
+        continue
+    todo.append(job)
+  if monitor is not None:
+    monitor.update(len(results))
+  if n_workers is None:
+    n_workers = max(1, (os.cpu_count() or 1) // threads_per_job)
+  if todo:
+    # Each job is a new process (rather than a forked worker), so that it starts with its thread limits instead of inheriting the thread pools of this process.
+    # The threads of the pool only wait for their job process to finish.
+    with ThreadPoolExecutor(max_workers=min(n_workers, len(todo))) as pool:
+      futures = {pool.submit(_start_job, job, threads_per_job): job for job in todo}
+      for future in as_completed(futures):
+        try:
+          results.append(future.result())
+        except RuntimeError as error:
+          print(error)
+        if monitor is not None:
+          monitor.update(1)
+  if not results:
+    raise RuntimeError(f"All jobs failed, see the train.log files in {out_dir / 'jobs'}")
+
+  results = pd.DataFrame(results).sort_values(['setting', 'fold']).reset_index(drop=True)
+  board = leaderboard(results, sort_by)
+  results.to_csv(out_dir / "jobs.csv", index=False)
+  board.to_csv(out_dir / "leaderboard.csv", index=False)
+  return board, results
+
+if __name__ == '__main__':
+  # Job process: python -m twitter_pipeline.tuning <job_dir>//job.json
+  with open(sys.argv[1]) as f:
+    _run_job(json.load(f))